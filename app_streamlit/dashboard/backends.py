@@ -0,0 +1,113 @@
+"""Data backends running the dashboard queries, hosted or in-process."""
+
+import os
+import re
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+from supabase import create_client
+
+import sql_queries
+
+SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR", str(Path(__file__).parents[2] / "data" / "snapshot")
+)
+
+# Tables exported by the ETL snapshot, see etl/snapshot.py
+SNAPSHOT_TABLES = [
+    "pollutants",
+    "locations",
+    "measurement_rollups",
+    "measurement_details",
+    "etl_runs",
+]
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+# Postgres spellings of sql_queries that DuckDB writes differently. numeric
+# would default to 3 decimals in DuckDB, doubles round the same way.
+DUCKDB_REWRITES = [
+    (PLACEHOLDER, r"$\1"),
+    (re.compile(r"::numeric\b"), "::double"),
+    (re.compile(r"\bcardinality\("), "len("),
+]
+
+
+class SupabaseBackend:
+    """Calls the queries as RPCs of the hosted Supabase database."""
+
+    def __init__(self, url: str, key: str, page_size: int):
+        self.client = create_client(url, key)
+        # Kept within the PostgREST row cap
+        self.page_size = page_size
+
+    def rpc(self, function_name: str, params: dict) -> pd.DataFrame:
+        return pd.DataFrame(self.client.rpc(function_name, params).execute().data)
+
+    def select(self, table_name: str, columns: list[str]) -> pd.DataFrame:
+        response = self.client.from_(table_name).select(", ".join(columns)).execute()
+        return pd.DataFrame(response.data, columns=columns)
+
+    def data_version(self) -> int:
+        response = (
+            self.client.from_("etl_runs")
+            .select("id")
+            .order("id", desc=True)
+            .limit(1)
+            .execute()
+        )
+        return response.data[0]["id"] if response.data else 0
+
+
+class DuckDBBackend:
+    """Runs the queries of sql_queries in-process on the ETL Parquet snapshot.
+
+    Each table of the snapshot is a view over its file, read again by every
+    query, so a new export is picked up without restarting the dashboard.
+    """
+
+    # Pages only bound memory here, there is no row cap to stay within
+    page_size = 100_000
+
+    def __init__(self, directory: str = SNAPSHOT_DIR):
+        directory = Path(directory)
+        missing = [
+            table_name
+            for table_name in SNAPSHOT_TABLES
+            if not (directory / f"{table_name}.parquet").exists()
+        ]
+        if missing:
+            raise FileNotFoundError(
+                f"No snapshot of {', '.join(missing)} in {directory}, "
+                "export one with etl/snapshot.py"
+            )
+
+        self.connection = duckdb.connect()
+        for table_name in SNAPSHOT_TABLES:
+            path = (directory / f"{table_name}.parquet").as_posix()
+            self.connection.execute(
+                f"CREATE VIEW {table_name} AS SELECT * FROM read_parquet('{path}')"
+            )
+
+    def query(self, query: str, params: dict = None) -> pd.DataFrame:
+        # Connections are not thread-safe, each query gets its own cursor
+        with self.connection.cursor() as cursor:
+            return cursor.execute(query, params).df()
+
+    def rpc(self, function_name: str, params: dict) -> pd.DataFrame:
+        query = getattr(sql_queries, function_name, None)
+        if not isinstance(query, str):
+            raise ValueError(f"No query named {function_name} in sql_queries")
+
+        # DuckDB rejects parameters the query does not use
+        names = set(PLACEHOLDER.findall(query))
+        for pattern, replacement in DUCKDB_REWRITES:
+            query = pattern.sub(replacement, query)
+        return self.query(query, {name: params[name] for name in names})
+
+    def select(self, table_name: str, columns: list[str]) -> pd.DataFrame:
+        return self.query(f"SELECT {', '.join(columns)} FROM {table_name}")
+
+    def data_version(self) -> int:
+        return int(self.query("SELECT COALESCE(MAX(id), 0) FROM etl_runs").iat[0, 0])
@@ -5,11 +5,11 @@ from PIL import Image
 
 from data_generation import (
     get_all_measures,
-    get_heatmap_measures,
+    get_heatmap_data,
     get_measurements_daterange_data,
     get_locations,
+    get_reduction_data,
 )
-from data_transformation import transforms_measures_to_reduction
 from plots import generate_heatmap
 from pollutants import pollutants_info
 from rendering import (
@@ -190,39 +190,17 @@ if go1_clicked:
                 pollutants_info[pollutant]["code"] for pollutant in selected_pollutants
             ]
 
-            # 🔹 Heavy data fetching and processing (run once)
-            heat_data = pd.DataFrame()
-            for pol in pollutants_code:
-                heat_data = pd.concat(
-                    [heat_data, get_heatmap_measures(pol, start_date_str, end_date_str)]
-                )
-            if heat_data.empty:
-                heat_data = pd.DataFrame(
-                    columns=[
-                        "town",
-                        "latitude",
-                        "longitude",
-                        "pollutant",
-                        "units",
-                        "average",
-                        "datetime_from",
-                        "datetime_to",
-                    ]
-                )
-            df_grouped = (
-                heat_data.groupby(["town", "latitude", "longitude"]).sum().reset_index()
+            # 🔹 Towns measuring all selected pollutants, summed in one RPC call
+            st.session_state.heatmap = get_heatmap_data(
+                pollutants_code, start_date_str, end_date_str
             )
-            df_grouped = df_grouped[df_grouped["pollutant"] == "".join(pollutants_code)]
-
-            st.session_state.heat_data = heat_data
-            st.session_state.df_grouped = df_grouped
             st.session_state.pollutants_code = pollutants_code
 
-if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
+if st.session_state.get("go1", False) and "heatmap" in st.session_state:
     selected_pollutants = st.session_state.selected_pollutants
     start_date_str = st.session_state.start_date_str
     end_date_str = st.session_state.end_date_str
-    df_grouped = st.session_state.df_grouped
+    df_grouped = st.session_state.heatmap.value
     pollutants_code = st.session_state.pollutants_code
 
     col1, col2 = st.columns(2)
@@ -269,13 +247,22 @@ if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
                     st.session_state.location_filter_by = location_filter_by
                     st.session_state.selected_location = selected_location
                     with st.spinner(""):
+                        progress = st.empty()
                         try:
-                            st.session_state.measurements_df = (
+                            # Shared with the sessions loading the same range,
+                            # along with its cube aggregated once per load
+                            st.session_state.measurements = (
                                 get_measurements_daterange_data(
                                     start_date_str,
                                     end_date_str,
+                                    pollutants_code,
+                                    location_filter_by,
+                                    on_progress=lambda rows: progress.caption(
+                                        f"{rows:,} rows loaded"
+                                    ),
                                 )
                             )
+                            progress.empty()
                             # Optionally, you can also store other relevant data from here, like `seasons_df`
                         except Exception as e:
                             st.markdown(
@@ -287,7 +274,7 @@ if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
         if st.session_state.go1 and st.session_state.go2:
             location_filter_by = st.session_state.location_filter_by
             selected_location = st.session_state.selected_location
-            measurements_df = st.session_state.measurements_df
+            measurements_df, measurements_cube = st.session_state.measurements.value
 
             with st.container(height=700):
                 with st.spinner("📈 Loading pollution trend..."):
@@ -295,7 +282,7 @@ if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
                         tab1, tab2 = st.tabs(["📊 Graph", "📋 Table"])
                         with tab1:
                             render_pollution_trend_tab(
-                                measurements_df,
+                                measurements_cube,
                                 selected_location,
                                 location_filter_by,
                                 pollutants_code,
@@ -313,7 +300,7 @@ if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
                         tab1, tab2 = st.tabs(["📊 Graph", "📋 Table"])
                         with tab1:
                             render_pollution_levels_tab(
-                                measurements_df,
+                                measurements_cube,
                                 location_filter_by,
                                 pollutants_code,
                                 selected_location,
@@ -329,10 +316,10 @@ if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
 
                 with st.spinner("📊 Loading variation comparison..."):
                     try:
-                        reduction_data = transforms_measures_to_reduction(
-                            measurements_df,
+                        reduction_data = get_reduction_data(
                             start_date_str,
                             end_date_str,
+                            pollutants_code,
                         )
                         tab1, tab2 = st.tabs(["📊 Graph", "📋 Table"])
                         with tab1:
@@ -352,11 +339,13 @@ if st.session_state.get("go1", False) and "df_grouped" in st.session_state:
                 st.markdown("___", unsafe_allow_html=True)
                 with st.spinner("📡 Loading sensor data..."):
                     try:
-                        sensors_df = get_all_measures()
+                        # Kept by the session so that the store does not evict it
+                        st.session_state.sensors = get_all_measures()
+                        sensors_df, sensors_cube = st.session_state.sensors.value
                         tab1, tab2 = st.tabs(["📊 Graph", "📋 Table"])
                         with tab1:
                             render_sensors_tab(
-                                sensors_df,
+                                sensors_cube,
                                 location_filter_by,
                                 pollutants_code,
                             )
@@ -1,27 +1,96 @@
-"""Import data from postgreSQL database that is hosted on supabase."""
+"""Import data from postgreSQL database that is hosted on supabase.
+
+With DASHBOARD_BACKEND=duckdb, the same queries run in-process on the Parquet
+snapshot exported by the ETL instead, and Supabase is not needed.
+"""
 
 import os
+import sys
+from collections.abc import Callable
 
-from supabase import create_client, Client
+import numpy as np
 import pandas as pd
 import streamlit as st
+from pandas.api.types import union_categoricals
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 from dotenv import load_dotenv
 
+from backends import DuckDBBackend, SupabaseBackend
+from data_transformation import MeasurementCube
+from shared_store import Lease, SharedStore
+
 load_dotenv()
 
 # --- Supabase config ---
 url = "https://dluhqrwmercbvgfhoxef.supabase.co"
 key = os.getenv("SUPABASE_KEY")
 
-supabase: Client = create_client(url, key)
-
 pollutant_list = ["co", "o3", "no", "no2", "pm10", "pm25", "so2"]
 
+# Results are shared by every session and rerun. Each entry is keyed by its
+# function, arguments and the latest ETL run, so a load invalidates them all.
+# Concurrent calls with the same key wait for a single backend call.
+CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "3600"))
+DATA_VERSION_TTL = int(os.getenv("DASHBOARD_DATA_VERSION_TTL", "60"))
 
-def get_locations() -> pd.DataFrame:
-    response = supabase.from_("locations").select("town, department, region").execute()
-    return pd.DataFrame(response.data)
+# st.cache_data hands each caller its own copy. Measurements and heatmaps are
+# held once in a store instead, sessions keeping a lease on them.
+store = SharedStore(int(os.getenv("DASHBOARD_STORE_MB", "512")) * 2**20)
+
+# Rows requested per page of the paged RPCs, kept within the PostgREST row cap
+PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "1000"))
+
+if os.getenv("DASHBOARD_BACKEND", "supabase") == "duckdb":
+    backend = DuckDBBackend()
+else:
+    backend = SupabaseBackend(url, key, PAGE_SIZE)
+
+# RPC parameter of each keyset column, set to the last row of the previous page
+DATETIME_KEYSET = {"after_datetime": "datetime_from", "after_id": "id"}
+LOCATION_KEYSET = {"after_town": "town", "after_pollutant": "pollutant_name"}
+
+# Measurement frames are held by every session, so they are stored compact:
+# repeated names as categories, values as float32 like the REAL column.
+FILTER_DTYPES = {
+    "id": "int64",
+    "town": "category",
+    "region": "category",
+    "department": "category",
+    "sensor_id": "int64",
+    "pollutant_name": "category",
+    "datetime_from": "datetime64[ns]",
+    "datetime_to": "datetime64[ns]",
+}
+
+MEASUREMENT_DTYPES = {
+    "id": "int64",
+    "town": "category",
+    "department": "category",
+    "region": "category",
+    "pollutant_name": "category",
+    "pollutant_units": "category",
+    "value": "float32",
+    "datetime_from": "datetime64[ns]",
+    "datetime_to": "datetime64[ns]",
+}
+
+REDUCTION_DTYPES = {
+    "town": "object",
+    "department": "object",
+    "region": "object",
+    "pollutant_name": "object",
+    "pollutant_units": "object",
+    "value": "float64",
+    "datetime_from": "datetime64[ns]",
+    "datetime_to": "datetime64[ns]",
+    "reduction": "float64",
+}
+
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def get_data_version() -> int:
+    """Returns the ID of the latest ETL run, 0 before the first one."""
+    return backend.data_version()
 
 
 @retry(
@@ -29,14 +98,171 @@ def get_locations() -> pd.DataFrame:
     wait=wait_random_exponential(min=0.1, max=10),
     stop=stop_after_attempt(10),
 )
-def get_all_measures() -> pd.DataFrame:
-    response = supabase.rpc("get_filter_data").execute()
-    all_measures = pd.DataFrame(response.data)
+def fetch_page(function_name: str, params: dict) -> pd.DataFrame:
+    return backend.rpc(function_name, params)
+
+
+def fetch_all_pages(
+    function_name: str,
+    params: dict,
+    dtypes: dict[str, str],
+    on_progress: Callable[[int], None] = None,
+    keyset: dict[str, str] = DATETIME_KEYSET,
+) -> pd.DataFrame:
+    """Retrieves every row of a keyset-paged RPC, one page at a time.
+
+    Each page starts after the keyset columns of the last row of the previous
+    one and is converted to `dtypes` as it arrives. Pages stop on an empty one rather
+    than a short one, so a server-side row cap below the backend page size
+    cannot silently truncate the result.
+
+    Args:
+        function_name (str): Name of the RPC.
+        params (dict): RPC parameters besides the paging ones.
+        dtypes (dict[str, str]): Column dtypes of the returned frame.
+        on_progress (Callable[[int], None], optional): Called with the number
+            of rows retrieved so far after each page.
+        keyset (dict[str, str], optional): Column of each paging parameter,
+            the rows being ordered by these columns.
+    """
+    pages = []
+    rows = 0
+    after = dict.fromkeys(keyset)
+    while True:
+        page = fetch_page(
+            function_name, {**params, **after, "page_size": backend.page_size}
+        )
+        if page.empty:
+            break
+        pages.append(page.reindex(columns=list(dtypes)).astype(dtypes))
+        rows += len(page)
+        after = {
+            param: to_param(pages[-1][column].iat[-1])
+            for param, column in keyset.items()
+        }
+        if on_progress:
+            on_progress(rows)
+
+    if not pages:
+        return pd.DataFrame(columns=list(dtypes)).astype(dtypes)
+    return concat_pages(pages, dtypes)
+
+
+def concat_pages(pages: list[pd.DataFrame], dtypes: dict[str, str]) -> pd.DataFrame:
+    """Concatenates converted pages, keeping their categorical columns.
+
+    Each page has its own categories, which pd.concat would turn back into
+    objects. They are merged into sorted categories instead, so that groups
+    on the codes come out in the same order as on the names.
+    """
+    categorical = [column for column, dtype in dtypes.items() if dtype == "category"]
+    df = pd.concat(
+        [page.drop(columns=categorical) for page in pages], ignore_index=True
+    )
+    for column in categorical:
+        df[column] = union_categoricals(
+            [page[column] for page in pages], sort_categories=True
+        )
+    return df[list(dtypes)]
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the bytes held by each column, as stored and as plain dtypes.
+
+    Plain dtypes are objects for categories and float64 for float32 values,
+    as measurement frames were loaded before being compact. Their size is
+    worked out from the categories, without converting the frame. The last
+    row sums up every column.
+    """
+    report = pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str),
+            "bytes": df.memory_usage(index=False, deep=True),
+        }
+    )
+    report["loose_bytes"] = report["bytes"]
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            # A pointer per row, to a string object per row as pandas counts it
+            counts = df[column].value_counts(sort=False)
+            sizes = [sys.getsizeof(category) for category in counts.index]
+            report.loc[column, "loose_bytes"] = 8 * len(df) + int(counts @ sizes)
+        elif dtype == "float32":
+            report.loc[column, "loose_bytes"] = 8 * len(df)
+    report.loc["total"] = ["", report["bytes"].sum(), report["loose_bytes"].sum()]
+    report["ratio"] = report["loose_bytes"] / report["bytes"]
+    return report
+
+
+def log_memory(name: str, df: pd.DataFrame):
+    """Prints the memory held by a loaded frame, compared to plain dtypes."""
+    total = memory_report(df).loc["total"]
+    print(
+        f"Loaded {len(df):,} rows of {name} in {total['bytes'] / 2**20:.1f} MB "
+        f"({total['loose_bytes'] / 2**20:.1f} MB with plain dtypes)"
+    )
+
+
+def to_param(value) -> str | int | float:
+    """Converts a keyset value to a plain Python one, sent as JSON by Supabase."""
+    if isinstance(value, pd.Timestamp):
+        return str(value)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def get_locations() -> pd.DataFrame:
+    return _get_locations(get_data_version())
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _get_locations(data_version: int) -> pd.DataFrame:
+    return backend.select("locations", ["town", "department", "region"])
+
+
+def get_all_measures(on_progress: Callable[[int], None] = None) -> Lease:
+    """Returns a lease on the sensors of every measurement and their cube."""
+    store_key = ("sensors", get_data_version())
+    return store.lease(
+        store_key, lambda: _get_all_measures(*store_key[1:], on_progress)
+    )
+
+
+def _get_all_measures(
+    data_version: int, on_progress: Callable[[int], None] = None
+) -> tuple[pd.DataFrame, MeasurementCube]:
+    all_measures = fetch_all_pages("get_filter_data", {}, FILTER_DTYPES, on_progress)
     all_measures = all_measures[all_measures["department"] != "Not_found"]
     all_measures = all_measures[all_measures["region"] != "Île-de-france"]
-    all_measures["datetime_from"] = pd.to_datetime(all_measures["datetime_from"])
-    all_measures["datetime_to"] = pd.to_datetime(all_measures["datetime_to"])
-    return all_measures
+    log_memory("sensors", all_measures)
+    return all_measures, MeasurementCube(all_measures)
+
+
+HEATMAP_COLUMNS = [
+    "town",
+    "latitude",
+    "longitude",
+    "pollutant",
+    "units",
+    "average",
+    "datetime_from",
+    "datetime_to",
+]
+
+
+def get_heatmap_data(
+    pollutant_names: list[str],
+    start_date: str,
+    end_date: str,
+) -> Lease:
+    """Returns a lease on the towns measuring every pollutant, with summed averages."""
+    store_key = (
+        "heatmap",
+        tuple(pollutant_names),
+        start_date,
+        end_date,
+        get_data_version(),
+    )
+    return store.lease(store_key, lambda: _get_heatmap_data(*store_key[1:]))
 
 
 @retry(
@@ -44,50 +270,110 @@ def get_all_measures() -> pd.DataFrame:
     wait=wait_random_exponential(min=0.1, max=10),
     stop=stop_after_attempt(10),
 )
-def get_heatmap_measures(
-    pollutant_name: str,
+def _get_heatmap_data(
+    pollutant_names: tuple[str],
     start_date: str,
     end_date: str,
+    data_version: int,
 ) -> pd.DataFrame:
 
-    response = supabase.rpc(
-        "heatmap_data",
+    heatmap_df = backend.rpc(
+        "heatmap_data_multi",
         {
-            "pollutant_name": pollutant_name,
+            "pollutant_names": list(pollutant_names),
             "start_date": end_date,  # hack to only generate latest instead of average
             "end_date": end_date,
         },
-    ).execute()
+    )
 
-    return pd.DataFrame(response.data)
+    return heatmap_df.reindex(columns=HEATMAP_COLUMNS)
 
 
 def get_measurements_daterange_data(
     start_date: str,
     end_date: str,
-) -> pd.DataFrame:
-    response = supabase.rpc(
+    pollutant_names: list[str],
+    location_level: str = "department",
+    locations: list[str] = None,
+    on_progress: Callable[[int], None] = None,
+) -> Lease:
+    """Returns a lease on the measurements of some pollutants within a date range.
+
+    Filtering and cleanup happen in the database, `locations` restricts the
+    rows to some towns, departments or regions depending on `location_level`.
+    Rows are retrieved page by page, reporting progress to `on_progress`.
+    The leased value is the frame and its MeasurementCube, loaded once for
+    every session asking for the same rows.
+    """
+    # The level only matters with locations, leave it out of the key otherwise
+    store_key = (
+        "measurements",
+        start_date,
+        end_date,
+        tuple(pollutant_names),
+        location_level if locations else None,
+        tuple(locations) if locations else None,
+        get_data_version(),
+    )
+    return store.lease(
+        store_key, lambda: _get_measurements_daterange_data(*store_key[1:], on_progress)
+    )
+
+
+def _get_measurements_daterange_data(
+    start_date: str,
+    end_date: str,
+    pollutant_names: tuple[str],
+    location_level: str | None,
+    locations: tuple[str] | None,
+    data_version: int,
+    on_progress: Callable[[int], None] = None,
+) -> tuple[pd.DataFrame, MeasurementCube]:
+    measurements = fetch_all_pages(
         "get_measurements_by_date_range",
         {
             "start_date": start_date,
             "end_date": end_date,
+            "pollutant_names": list(pollutant_names),
+            "location_level": location_level,
+            "locations": list(locations) if locations else None,
         },
-    ).execute()
-    df = pd.DataFrame(response.data)
-    df = df[df["department"] != "Not_found"]
-    df['region'] = df['region'].replace("Île-de-france", "Île-de-France")
-    return df
+        MEASUREMENT_DTYPES,
+        on_progress,
+    )
+    log_memory("measurements", measurements)
+    return measurements, MeasurementCube(measurements)
 
 
 def get_reduction_data(
     start_date: str,
     end_date: str,
+    pollutant_names: list[str],
 ) -> pd.DataFrame:
-    response = supabase.rpc(
+    """Returns the start-versus-end reduction of each town and pollutant.
+
+    Computed in the database over the rows of get_measurements_daterange_data,
+    so only one row per town and pollutant is retrieved.
+    """
+    return _get_reduction_data(
+        start_date, end_date, tuple(pollutant_names), get_data_version()
+    )
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _get_reduction_data(
+    start_date: str,
+    end_date: str,
+    pollutant_names: tuple[str],
+    data_version: int,
+) -> pd.DataFrame:
+    return fetch_all_pages(
         "get_pollution_reduction",
-        {"start_date": start_date, "end_date": end_date},
-    ).execute()
-    df = pd.DataFrame(response.data)
-    df = df[df["department"] != "Not_found"]
-    df = df[df["region"] != "Île-de-france"]
-    return df
+        {
+            "start_date": start_date,
+            "end_date": end_date,
+            "pollutant_names": list(pollutant_names),
+        },
+        REDUCTION_DTYPES,
+        keyset=LOCATION_KEYSET,
+    )
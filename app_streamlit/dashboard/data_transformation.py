@@ -2,13 +2,130 @@
 
 import pandas as pd
 
+LOCATION_LEVELS = ["town", "department", "region"]
+
+SEASONS = {
+    12: "Winter",
+    1: "Winter",
+    2: "Winter",
+    3: "Spring",
+    4: "Spring",
+    5: "Spring",
+    6: "Summer",
+    7: "Summer",
+    8: "Summer",
+    9: "Fall",
+    10: "Fall",
+    11: "Fall",
+}
+
+
+class MeasurementCube:
+    """Aggregates of a measurements frame for every location level.
+
+    Built once per loaded frame. For each level, `cells` holds the count and
+    sum of the values per location, pollutant and period (datetime_to),
+    `totals` the same over the whole range, and `sensors` the number of
+    distinct sensors per location and pollutant. Changing the level or the
+    locations of a tab slices these tables instead of regrouping every
+    measurement, and averages are sums over counts.
+
+    The quartiles of each period and the seasonal sums do not depend on the
+    level, they are computed once over all the measurements. Tables relying
+    on a column missing from the frame, value or sensor_id, are left empty.
+    """
+
+    def __init__(self, measurements: pd.DataFrame):
+        self.cells = {}
+        self.totals = {}
+        self.sensors = {}
+        self.quartiles = pd.DataFrame(columns=["Q25", "Q75"])
+        self.seasons = pd.DataFrame(
+            columns=["pollutant_name", "season", "count", "sum"]
+        )
+
+        if "value" in measurements:
+            # Summed in float64 whatever the storage of the values
+            values = measurements["value"].astype("float64")
+            for level in LOCATION_LEVELS:
+                self.cells[level] = decode_categories(
+                    values.groupby(
+                        [
+                            measurements[level],
+                            measurements["pollutant_name"],
+                            measurements["datetime_to"],
+                        ],
+                        observed=True,
+                    )
+                    .agg(["count", "sum"])
+                    .reset_index()
+                )
+                self.totals[level] = (
+                    self.cells[level]
+                    .groupby([level, "pollutant_name"])[["count", "sum"]]
+                    .sum()
+                    .reset_index()
+                )
+
+            quartiles = (
+                values.groupby(
+                    [measurements["datetime_to"], measurements["pollutant_name"]],
+                    observed=True,
+                )
+                .quantile([0.25, 0.75])
+                .unstack()
+                .reindex(columns=[0.25, 0.75])
+                .reset_index()
+            )
+            self.quartiles = decode_categories(quartiles).set_index(
+                ["datetime_to", "pollutant_name"]
+            )
+            self.quartiles.columns = ["Q25", "Q75"]
+
+            seasons = pd.to_datetime(measurements["datetime_from"]).dt.month.map(
+                SEASONS
+            )
+            self.seasons = decode_categories(
+                values.groupby(
+                    [measurements["pollutant_name"], seasons.rename("season")],
+                    observed=True,
+                )
+                .agg(["count", "sum"])
+                .reset_index()
+            )
+
+        if "sensor_id" in measurements:
+            for level in LOCATION_LEVELS:
+                self.sensors[level] = decode_categories(
+                    measurements.groupby([level, "pollutant_name"], observed=True)[
+                        "sensor_id"
+                    ]
+                    .nunique()
+                    .reset_index()
+                )
+
+
+def decode_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """Turns the categorical columns of a grouped table back into names.
+
+    Measurements are grouped on their category codes, only the few rows of
+    the tables built from them are decoded.
+    """
+    return df.astype(
+        {
+            column: dtype.categories.dtype
+            for column, dtype in df.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype)
+        }
+    )
+
 
 class PollutionSensors:
 
     @classmethod
     def rank_by_number_of_sensors(
         cls,
-        locations_df: pd.DataFrame,
+        cube: MeasurementCube,
         location_filter_by: str,
         pollutants: list[str],
     ) -> pd.DataFrame:
@@ -16,9 +133,7 @@ class PollutionSensors:
         Rank locations by the number of sensors per pollutant and return a ranked dataframe.
         """
         # Step 1: Get the number of sensors per location and pollutant
-        sensors_per_location = cls.group_by_number_of_sensors(
-            locations_df, location_filter_by
-        )
+        sensors_per_location = cls.group_by_number_of_sensors(cube, location_filter_by)
 
         # Step 2: Rank the locations based on the number of sensors
         ranked_sensors = cls.rank_by_number_of_sensors_per_pollutants(
@@ -29,17 +144,12 @@ class PollutionSensors:
 
     @staticmethod
     def group_by_number_of_sensors(
-        locations_df: pd.DataFrame, location_filter_by: str
+        cube: MeasurementCube, location_filter_by: str
     ) -> pd.DataFrame:
         """
-        Group the dataframe by location and pollutant, and count the number of unique sensors.
+        Take the number of unique sensors per location and pollutant from the cube.
         """
-        sensors_per_location_filter = (
-            locations_df.groupby([location_filter_by, "pollutant_name"])["sensor_id"]
-            .nunique()
-            .reset_index()
-        )
-        sensors_per_location_filter = sensors_per_location_filter.sort_values(
+        sensors_per_location_filter = cube.sensors[location_filter_by].sort_values(
             by="sensor_id"
         )
         sensors_per_location_filter["x_key"] = (
@@ -195,20 +305,22 @@ class PollutionLevel:
     @classmethod
     def rank_by_average_concentration(
         cls,
-        measurements_df: pd.DataFrame,
+        cube: MeasurementCube,
         location_filter_by: str,
         pollutants: list[str],
         top_n: int = 10,
         reference_locations: list[str] = None,
     ) -> pd.DataFrame:
+        totals = cube.totals[location_filter_by]
+
         # Step 1: Get valid locations with all target pollutants
         valid_locations = cls.get_valid_locations(
-            measurements_df, location_filter_by, pollutants
+            totals, location_filter_by, pollutants
         )
 
         # Step 2: Filter and average pollutants
         avg_pollutant_df = cls.filter_and_avg_pollutants(
-            measurements_df, location_filter_by, pollutants, valid_locations
+            totals, location_filter_by, pollutants, valid_locations
         )
 
         # Step 3: Get top N locations based on average concentration
@@ -224,7 +336,7 @@ class PollutionLevel:
         # Step 5: Build reference location data if provided
         reference_location_df = (
             cls.build_reference_location_df(
-                measurements_df, location_filter_by, pollutants, reference_locations
+                totals, location_filter_by, pollutants, reference_locations
             )
             if reference_locations
             else pd.DataFrame()
@@ -267,15 +379,17 @@ class PollutionLevel:
         valid_locations: pd.Series,
     ) -> pd.DataFrame:
         """
-        Filters the dataframe and calculates the average value per pollutant for each location.
+        Filters the totals and calculates the average value per pollutant for each location.
         """
         df_filtered = df[
             (df[location_filter_by].isin(valid_locations))
             & (df["pollutant_name"].isin(pollutants))
         ]
-        return df_filtered.groupby(
-            [location_filter_by, "pollutant_name"], as_index=False
-        )["value"].mean()
+        return (
+            df_filtered[[location_filter_by, "pollutant_name"]]
+            .assign(value=df_filtered["sum"] / df_filtered["count"])
+            .reset_index(drop=True)
+        )
 
     @staticmethod
     def get_top_locations(
@@ -308,7 +422,9 @@ class PollutionLevel:
             ]
             if ref_df.empty:
                 continue
-            ref_avg = ref_df.groupby("pollutant_name", as_index=False)["value"].mean()
+            ref_avg = ref_df[["pollutant_name"]].assign(
+                value=ref_df["sum"] / ref_df["count"]
+            )
             ref_avg[location_filter_by] = f"SELECTED: {ref}"
             ref_dfs.append(ref_avg[[location_filter_by, "pollutant_name", "value"]])
 
@@ -342,7 +458,7 @@ class PollutionLevel:
 
 
 def prepare_time_series_data(
-    measurements: pd.DataFrame,
+    cube: MeasurementCube,
     selected_location: str,
     location_filter_by: str,
     pollutants: list[str],
@@ -354,13 +470,14 @@ def prepare_time_series_data(
         ]  # Default to a list containing "None" if no locations provided
 
     # Filter to keep only selected pollutants
-    df = measurements[measurements["pollutant_name"].isin(pollutants)]
+    cells = cube.cells[location_filter_by]
+    cells = cells[cells["pollutant_name"].isin(pollutants)]
 
-    # Group and average values
+    # Average values
     df_grouped = (
-        df.groupby([location_filter_by, "pollutant_name", "datetime_to"])
-        .agg(average=("value", "mean"))
-        .reset_index()
+        cells[[location_filter_by, "pollutant_name", "datetime_to"]]
+        .assign(average=cells["sum"] / cells["count"])
+        .reset_index(drop=True)
     )
 
     # Filter data for the selected location
@@ -374,17 +491,9 @@ def prepare_time_series_data(
         df_location = df_grouped[df_grouped[location_filter_by] == compare_location]
         df_compare = pd.concat([df_compare, df_location])
 
-    # Compute Q25 / Q75
-    quantiles = (
-        df.groupby(["datetime_to", "pollutant_name"])["value"]
-        .quantile([0.25, 0.75])
-        .unstack()
-    )
-    quantiles.columns = ["Q25", "Q75"]
-
-    # Merge quantiles with the filtered df
+    # Merge Q25 / Q75 with the filtered df
     df_filtered = df_filtered.merge(
-        quantiles,
+        cube.quartiles,
         left_on=["datetime_to", "pollutant_name"],
         right_index=True,
         how="left",
@@ -418,31 +527,18 @@ def prepare_time_stats_data(
 
 
 def build_seasons_df(
-    df: pd.DataFrame,
+    cube: MeasurementCube,
     selected_pollutants: list[str],
 ):
-    df_filtered = df[df["pollutant_name"].isin(selected_pollutants)]
-
-    df_filtered["datetime_from"] = pd.to_datetime(df_filtered["datetime_from"])
-
-    # Function to determine the season from a datetime
-    def get_season(date):
-        month = date.month
-        if month in [12, 1, 2]:
-            return "Winter"
-        elif month in [3, 4, 5]:
-            return "Spring"
-        elif month in [6, 7, 8]:
-            return "Summer"
-        else:
-            return "Fall"
-
-    # Apply the function to create a 'season' column
-    df_filtered["season"] = df_filtered["datetime_from"].apply(get_season)
-
-    # Calculate total values per season
+    seasons = cube.seasons[cube.seasons["pollutant_name"].isin(selected_pollutants)]
+
+    # Calculate average values per season
+    seasonal_sums = seasons.groupby(["season"])[["count", "sum"]].sum()
     seasonal_values = (
-        df_filtered.groupby(["season"])["value"].mean().round(2).reset_index()
+        (seasonal_sums["sum"] / seasonal_sums["count"])
+        .round(2)
+        .rename("value")
+        .reset_index()
     )
 
     season_order = ["Spring", "Summer", "Fall", "Winter"]
@@ -451,39 +547,3 @@ def build_seasons_df(
     )
 
     return seasonal_values
-
-
-def transforms_measures_to_reduction(df, start_date, end_date):
-    df["datetime_from"] = pd.to_datetime(df["datetime_from"])
-    df["datetime_to"] = pd.to_datetime(df["datetime_to"])
-
-    # Define your start and end date
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    # Find the closest datetime_from and datetime_to for each town and pollutant
-    def find_closest_dates(group, start_date, end_date):
-        closest_start = group.iloc[(group["datetime_from"] - start_date).abs().argmin()]
-        closest_end = group.iloc[(group["datetime_to"] - end_date).abs().argmin()]
-
-        return pd.DataFrame(
-            [
-                {
-                    "town": closest_start["town"],
-                    "department": closest_start["department"],
-                    "region": closest_start["region"],
-                    "pollutant_name": closest_start["pollutant_name"],
-                    "pollutant_units": closest_start["pollutant_units"],
-                    "value": closest_start["value"],
-                    "datetime_from": closest_start["datetime_from"],
-                    "datetime_to": closest_end["datetime_to"],
-                    "reduction": closest_start["value"] - closest_end["value"],
-                }
-            ]
-        )
-
-    return (
-        df.groupby(["town", "pollutant_name"])
-        .apply(find_closest_dates, start_date=start_date, end_date=end_date)
-        .reset_index(drop=True)
-    )
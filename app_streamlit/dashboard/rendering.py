@@ -4,6 +4,7 @@ import pandas as pd
 import streamlit as st
 
 from data_transformation import (
+    MeasurementCube,
     build_seasons_df,
     prepare_time_series_data,
     prepare_time_stats_data,
@@ -21,7 +22,7 @@ from plots import (
 
 
 def render_pollution_trend_tab(
-    measurements: pd.DataFrame,
+    cube: MeasurementCube,
     location: list[str],
     loc_filter: str,
     pollutants: list[str],
@@ -29,7 +30,7 @@ def render_pollution_trend_tab(
     selected_location = location[0]
     compare_locations = location[1:]
     df_filtered, df_compare = prepare_time_series_data(
-        measurements=measurements,
+        cube=cube,
         selected_location=selected_location,
         location_filter_by=loc_filter,
         pollutants=pollutants,
@@ -56,20 +57,20 @@ def render_pollution_trend_tab(
 
     with st.expander(label="Is the pollution seasonal ?"):
         seasons_df = build_seasons_df(
-            measurements,
+            cube,
             pollutants,
         )
         pie_plot_seasons(seasons_df)
 
 
 def render_pollution_levels_tab(
-    data: pd.DataFrame,
+    cube: MeasurementCube,
     loc_filter: str,
     pollutants: list[str],
     ref_locations: list[str],
 ):
     ranked = PollutionLevel.rank_by_average_concentration(
-        data, loc_filter, pollutants, top_n=10, reference_locations=ref_locations
+        cube, loc_filter, pollutants, top_n=10, reference_locations=ref_locations
     )
     bar_plot_average_concentration(ranked, loc_filter)
 
@@ -86,9 +87,9 @@ def render_pollution_change_tab(
     bar_plot_average_variation(ranked, loc_filter)
 
 
-def render_sensors_tab(data: pd.DataFrame, loc_filter: str, pollutants: list[str]):
+def render_sensors_tab(cube: MeasurementCube, loc_filter: str, pollutants: list[str]):
     ranked = PollutionSensors.rank_by_number_of_sensors(
-        data,
+        cube,
         loc_filter,
         pollutants,
     )
@@ -0,0 +1,117 @@
+"""Loaded results shared read-only by every session of the dashboard process."""
+
+import threading
+import weakref
+from collections import OrderedDict, deque
+from collections.abc import Callable, Hashable
+
+import pandas as pd
+
+
+class Lease:
+    """Reference of a session to a shared value, released once collected.
+
+    Kept in `st.session_state`, it is collected when replaced by another
+    lease or when the session ends. The value must not be modified.
+    """
+
+    def __init__(self, key: Hashable, value):
+        self.key = key
+        self.value = value
+
+
+class _Entry:
+    def __init__(self, value, nbytes: int):
+        self.value = value
+        self.nbytes = nbytes
+        self.refs = 0
+
+
+class SharedStore:
+    """Holds a single copy of each loaded result for all sessions.
+
+    Streamlit runs sessions as threads of one process, so sessions reference
+    the values held here without copying them, whereas st.cache_data hands
+    each caller its own unpickled copy. Memory then grows with the distinct
+    results loaded rather than with the number of sessions.
+
+    An entry is referenced by every live lease on it. Unreferenced entries
+    are kept for the next session asking for them, and evicted least
+    recently used first once the store holds more than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Keys being loaded, concurrent calls wait for the first one
+        self.loading = {}
+        # Entries of collected leases. Finalizers can run while the lock is
+        # held, they only queue the entry, counted down on the next lease.
+        self.released = deque()
+
+    def lease(self, key: Hashable, load: Callable[[], object]) -> Lease:
+        """Returns a lease on the value of `key`, calling `load` if not held.
+
+        Keys must include everything the value depends on, the data version
+        among them, since entries are never refreshed.
+        """
+        with self.lock:
+            load_lock = self.loading.setdefault(key, threading.Lock())
+
+        try:
+            with load_lock:
+                with self.lock:
+                    entry = self.entries.get(key)
+                    if entry:
+                        entry.refs += 1
+                        self.entries.move_to_end(key)
+                if entry is None:
+                    value = load()
+                    with self.lock:
+                        entry = self.entries[key] = _Entry(value, nbytes(value))
+                        entry.refs += 1
+        finally:
+            with self.lock:
+                if self.loading.get(key) is load_lock:
+                    del self.loading[key]
+
+        with self.lock:
+            self._collect()
+            self._evict()
+
+        lease = Lease(key, entry.value)
+        weakref.finalize(lease, self.released.append, entry)
+        return lease
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the entries of the store."""
+        with self.lock:
+            return sum(entry.nbytes for entry in self.entries.values())
+
+    def _collect(self):
+        while self.released:
+            self.released.popleft().refs -= 1
+
+    def _evict(self):
+        total = sum(entry.nbytes for entry in self.entries.values())
+        for key, entry in list(self.entries.items()):
+            if total <= self.max_bytes:
+                break
+            if entry.refs == 0:
+                del self.entries[key]
+                total -= entry.nbytes
+
+
+def nbytes(value) -> int:
+    """Returns the bytes held by the frames within a value."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return nbytes(vars(value))
+    return 0
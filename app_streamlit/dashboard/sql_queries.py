@@ -1,88 +1,222 @@
-"""Stored in supabase, call supabase.rpc('{function_name}',params = dict)"""
+"""Stored in supabase, call supabase.rpc('{function_name}',params = dict)
 
+Placeholders are named after the RPC parameters. The local backend runs the
+same queries on DuckDB over the Parquet snapshot exported by the ETL.
+
+get_filter_data, get_measurements_by_date_range and get_pollution_reduction
+read the joined measurement_details materialized view. heatmap_data and
+get_seasons read the monthly measurement_rollups, with averages weighted by
+each month's count so they match the averages over the underlying
+measurements. Both are refreshed by the ETL after each load.
+"""
+
+# Paged by keyset: pass the datetime_from and id of the last row received to
+# get the next page_size rows, NULL for the first page.
 get_filter_data = """
 SELECT
-l.town,
-l.region,
-l.department,
-s.id,
-p.name,
-m.datetimeFrom,
-m.datetimeTo
-FROM
-locations AS l
-JOIN sensors AS s ON s.location_id = l.id
-JOIN pollutants AS p ON p.id = s.pollutant_id
-JOIN measurements AS m ON m.sensor_id = s.id
+id,
+town,
+region,
+department,
+sensor_id,
+pollutant AS pollutant_name,
+datetimeFrom AS datetime_from,
+datetimeTo AS datetime_to
+FROM measurement_details
+WHERE %(after_datetime)s::timestamp IS NULL
+  OR (datetimeFrom, id) > (%(after_datetime)s::timestamp, %(after_id)s::bigint)
+ORDER BY datetimeFrom, id
+LIMIT %(page_size)s
 """
 
 heatmap_data = """
 SELECT
-  l.town,
+  r.location AS town,
   p.name AS pollutant,
   p.units,
-  ROUND(AVG(m.value)::numeric, 2) AS average,
-  MIN(m.datetimeFrom) AS datetime_from,
-  MAX(m.datetimeTo) AS datetime_to,
-  ROUND(AVG(l.latitude)::numeric, 4) AS latitude,
-  ROUND(AVG(l.longitude)::numeric, 4) AS longitude
-FROM measurements AS m
-JOIN sensors AS s ON s.id = m.sensor_id
-JOIN locations AS l ON l.id = s.location_id
-JOIN pollutants AS p ON p.id = s.pollutant_id
-WHERE p.name = %s
-  AND m.datetimeTo BETWEEN %s AND %s
-GROUP BY l.town, p.name, p.units
+  ROUND((SUM(r.sum) / SUM(r.count))::numeric, 2) AS average,
+  MIN(r.datetime_from) AS datetime_from,
+  MAX(r.datetime_to) AS datetime_to,
+  ROUND((SUM(r.latitude * r.count) / SUM(r.count))::numeric, 4) AS latitude,
+  ROUND((SUM(r.longitude * r.count) / SUM(r.count))::numeric, 4) AS longitude
+FROM measurement_rollups AS r
+JOIN pollutants AS p ON p.id = r.pollutant_id
+WHERE r.location_level = 'town'
+  AND p.name = %(pollutant_name)s
+  AND r.datetime_to BETWEEN %(start_date)s AND %(end_date)s
+GROUP BY r.location, p.name, p.units
+ORDER BY average DESC;
+"""
+
+
+# Sums the average of every selected pollutant per town, keeping only the
+# towns measuring all of them. Takes the pollutant names as an array.
+heatmap_data_multi = """
+WITH per_pollutant AS (
+  SELECT
+    r.location AS town,
+    p.name AS pollutant,
+    p.units,
+    ROUND((SUM(r.sum) / SUM(r.count))::numeric, 2) AS average,
+    MIN(r.datetime_from) AS datetime_from,
+    MAX(r.datetime_to) AS datetime_to,
+    SUM(r.latitude * r.count) AS latitude_sum,
+    SUM(r.longitude * r.count) AS longitude_sum,
+    SUM(r.count) AS count
+  FROM measurement_rollups AS r
+  JOIN pollutants AS p ON p.id = r.pollutant_id
+  WHERE r.location_level = 'town'
+    AND p.name = ANY(%(pollutant_names)s::text[])
+    AND r.datetime_to BETWEEN %(start_date)s AND %(end_date)s
+  GROUP BY r.location, p.name, p.units
+)
+SELECT
+  town,
+  ROUND((SUM(latitude_sum) / SUM(count))::numeric, 4) AS latitude,
+  ROUND((SUM(longitude_sum) / SUM(count))::numeric, 4) AS longitude,
+  string_agg(pollutant, ', ' ORDER BY pollutant) AS pollutant,
+  string_agg(units, ', ' ORDER BY pollutant) AS units,
+  SUM(average) AS average,
+  MIN(datetime_from) AS datetime_from,
+  MAX(datetime_to) AS datetime_to
+FROM per_pollutant
+GROUP BY town
+HAVING COUNT(*) = cardinality(%(pollutant_names)s::text[])
+  AND COUNT(DISTINCT pollutant) = cardinality(%(pollutant_names)s::text[])
 ORDER BY average DESC;
 """
 
 
+# Measurements of the selected pollutants within the date range, optionally
+# restricted to some towns, departments or regions (all when NULL). Rows
+# without a department are dropped and region names normalized here rather
+# than in the dashboard. Paged by keyset like get_filter_data.
 get_measurements_by_date_range= """
 SELECT
-    l.town,
-    l.department,
-    l.region,
-    p.name,
-    p.units,
-    m.value,
-    m.datetimeFrom,
-    m.datetimeTo
-FROM measurements AS m
-JOIN sensors AS s ON s.id = m.sensor_id
-JOIN locations AS l ON l.id = s.location_id
-JOIN pollutants AS p ON p.id = s.pollutant_id
+    id,
+    town,
+    department,
+    CASE WHEN region = 'Île-de-france' THEN 'Île-de-France' ELSE region END
+        AS region,
+    pollutant AS pollutant_name,
+    units AS pollutant_units,
+    value,
+    datetimeFrom AS datetime_from,
+    datetimeTo AS datetime_to
+FROM measurement_details
 WHERE
-    m.datetimeFrom BETWEEN %s AND %s
+    datetimeFrom BETWEEN %(start_date)s AND %(end_date)s
+    AND pollutant = ANY(%(pollutant_names)s::text[])
+    AND department <> 'Not_found'
+    AND (
+        %(locations)s::text[] IS NULL
+        OR CASE %(location_level)s
+            WHEN 'town' THEN town
+            WHEN 'department' THEN department
+            ELSE region
+        END = ANY(%(locations)s::text[])
+    )
+    AND (
+        %(after_datetime)s::timestamp IS NULL
+        OR (datetimeFrom, id)
+            > (%(after_datetime)s::timestamp, %(after_id)s::bigint)
+    )
+ORDER BY datetimeFrom, id
+LIMIT %(page_size)s
 """
 
 
 get_seasons = """
 SELECT
-  l.town,
-  l.department,
-  l.region,
+  r.location AS town,
+  r.department,
+  r.region,
   p.name AS pollutant,
   p.units,
-  ROUND(AVG(m.value)::numeric, 2) AS average,
-  MIN(m.datetimeFrom) AS datetime_from,
-  MAX(m.datetimeTo) AS datetime_to,
-  ROUND(AVG(l.latitude)::numeric, 4) AS latitude,
-  ROUND(AVG(l.longitude)::numeric, 4) AS longitude,
+  ROUND((SUM(r.sum) / SUM(r.count))::numeric, 2) AS average,
+  MIN(r.datetime_from) AS datetime_from,
+  MAX(r.datetime_to) AS datetime_to,
+  ROUND((SUM(r.latitude * r.count) / SUM(r.count))::numeric, 4) AS latitude,
+  ROUND((SUM(r.longitude * r.count) / SUM(r.count))::numeric, 4) AS longitude,
 
-  -- Définir les saisons en fonction du mois de `datetimeFrom` (ou `datetimeTo`)
+  -- Définir les saisons en fonction du mois de la période
   CASE
-    WHEN EXTRACT(MONTH FROM m.datetimeFrom) IN (12, 1, 2) THEN 'Hiver'
-    WHEN EXTRACT(MONTH FROM m.datetimeFrom) IN (3, 4, 5) THEN 'Printemps'
-    WHEN EXTRACT(MONTH FROM m.datetimeFrom) IN (6, 7, 8) THEN 'Été'
-    WHEN EXTRACT(MONTH FROM m.datetimeFrom) IN (9, 10, 11) THEN 'Automne'
+    WHEN EXTRACT(MONTH FROM r.month) IN (12, 1, 2) THEN 'Hiver'
+    WHEN EXTRACT(MONTH FROM r.month) IN (3, 4, 5) THEN 'Printemps'
+    WHEN EXTRACT(MONTH FROM r.month) IN (6, 7, 8) THEN 'Été'
+    WHEN EXTRACT(MONTH FROM r.month) IN (9, 10, 11) THEN 'Automne'
   END AS season
 
-FROM measurements AS m
-JOIN sensors AS s ON s.id = m.sensor_id
-JOIN locations AS l ON l.id = s.location_id
-JOIN pollutants AS p ON p.id = s.pollutant_id
-WHERE p.name = %s
-  AND m.datetimeTo BETWEEN %s AND %s
-GROUP BY l.town, l.department, l.region, p.name, p.units, season
+FROM measurement_rollups AS r
+JOIN pollutants AS p ON p.id = r.pollutant_id
+WHERE r.location_level = 'town'
+  AND p.name = %(pollutant_name)s
+  AND r.datetime_to BETWEEN %(start_date)s AND %(end_date)s
+GROUP BY r.location, r.department, r.region, p.name, p.units, season
 ORDER BY season, average DESC;
 """
+
+
+# Start-versus-end comparison of each town and pollutant over the rows of
+# get_measurements_by_date_range. The start record is the one whose
+# datetimeFrom is closest to start_date, the end record the one whose
+# datetimeTo is closest to end_date, the earliest on ties. Paged by keyset on
+# (town, pollutant), the last ones received or NULL for the first page.
+get_pollution_reduction = """
+WITH filtered AS (
+    SELECT
+        id,
+        town,
+        department,
+        CASE WHEN region = 'Île-de-france' THEN 'Île-de-France' ELSE region END
+            AS region,
+        pollutant,
+        units,
+        value,
+        datetimeFrom,
+        datetimeTo
+    FROM measurement_details
+    WHERE
+        datetimeFrom BETWEEN %(start_date)s AND %(end_date)s
+        AND pollutant = ANY(%(pollutant_names)s::text[])
+        AND department <> 'Not_found'
+        AND (
+            %(after_town)s::text IS NULL
+            OR (town, pollutant) > (%(after_town)s::text, %(after_pollutant)s::text)
+        )
+),
+closest_start AS (
+    SELECT DISTINCT ON (town, pollutant) *
+    FROM filtered
+    ORDER BY
+        town,
+        pollutant,
+        ABS(EXTRACT(EPOCH FROM datetimeFrom - %(start_date)s::timestamp)),
+        datetimeFrom,
+        id
+),
+closest_end AS (
+    SELECT DISTINCT ON (town, pollutant) town, pollutant, value, datetimeTo
+    FROM filtered
+    ORDER BY
+        town,
+        pollutant,
+        ABS(EXTRACT(EPOCH FROM datetimeTo - %(end_date)s::timestamp)),
+        datetimeFrom,
+        id
+)
+SELECT
+    s.town,
+    s.department,
+    s.region,
+    s.pollutant AS pollutant_name,
+    s.units AS pollutant_units,
+    s.value,
+    s.datetimeFrom AS datetime_from,
+    e.datetimeTo AS datetime_to,
+    s.value - e.value AS reduction
+FROM closest_start AS s
+JOIN closest_end AS e USING (town, pollutant)
+ORDER BY s.town, s.pollutant
+LIMIT %(page_size)s
+"""
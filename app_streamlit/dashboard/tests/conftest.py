@@ -0,0 +1,5 @@
+import os
+
+# data_generation creates its backend on import, the tests replace it
+os.environ["DASHBOARD_BACKEND"] = "supabase"
+os.environ.setdefault("SUPABASE_KEY", "test")
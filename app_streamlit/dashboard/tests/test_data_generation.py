@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+import data_generation
+from data_generation import FILTER_DTYPES, MEASUREMENT_DTYPES, fetch_all_pages
+
+
+class FakeBackend:
+    """Serves keyset pages of `rows` like PostgREST, `row_cap` rows at most."""
+
+    def __init__(self, rows: pd.DataFrame, page_size: int, row_cap: int):
+        self.rows = rows
+        self.page_size = page_size
+        self.row_cap = row_cap
+        self.calls = []
+
+    def rpc(self, function_name: str, params: dict) -> pd.DataFrame:
+        self.calls.append(params)
+        rows = self.rows.sort_values(["datetime_from", "id"])
+        if params["after_datetime"] is not None:
+            after = (pd.Timestamp(params["after_datetime"]), params["after_id"])
+            rows = rows[
+                [
+                    (pd.Timestamp(datetime_from), id_) > after
+                    for datetime_from, id_ in zip(rows["datetime_from"], rows["id"])
+                ]
+            ]
+        limit = min(params["page_size"], self.row_cap)
+        return rows.head(limit).reset_index(drop=True)
+
+
+def json_rows(count: int) -> pd.DataFrame:
+    """Rows as decoded from JSON, new towns appearing on later pages."""
+    months = pd.date_range("2024-01-01", periods=count, freq="MS")
+    return pd.DataFrame(
+        {
+            "id": range(count, 0, -1),
+            "town": [f"town{i // 5}" for i in range(count)],
+            "region": [f"region{i % 2}" for i in range(count)],
+            "department": [f"department{i // 7}" for i in range(count)],
+            "sensor_id": [100 + i % 4 for i in range(count)],
+            "pollutant_name": [["no2", "o3", "pm10"][i % 3] for i in range(count)],
+            "pollutant_units": "µg/m³",
+            "value": [i / 4 for i in range(count)],
+            # Three rows per period, so ties straddle the pages
+            "datetime_from": [months[i // 3].isoformat() for i in range(count)],
+            "datetime_to": [months[i // 3 + 1].isoformat() for i in range(count)],
+        }
+    )
+
+
+@pytest.mark.parametrize("dtypes", [FILTER_DTYPES, MEASUREMENT_DTYPES])
+def test_pages_below_row_cap_return_every_row_once(monkeypatch, dtypes):
+    rows = json_rows(23)
+    backend = FakeBackend(rows, page_size=10, row_cap=4)
+    monkeypatch.setattr(data_generation, "backend", backend)
+
+    df = fetch_all_pages("get_filter_data", {}, dtypes)
+
+    # Short pages are not taken as the last one, only the empty page is
+    assert len(backend.calls) == 7
+    assert all(call["page_size"] == 10 for call in backend.calls)
+    assert sorted(df["id"]) == sorted(rows["id"])
+    assert df.dtypes.astype(str).to_dict() == dtypes
+
+    expected = rows.set_index("id").loc[df["id"], list(dtypes)[1:]]
+    for column, dtype in dtypes.items():
+        if dtype == "category":
+            # Categories of every page, not only the first one
+            assert list(df[column].cat.categories) == sorted(rows[column].unique())
+            assert list(df[column].astype(str)) == list(expected[column])
+        elif column != "id":
+            assert list(df[column]) == list(expected[column].astype(dtype))
+
+
+def test_no_rows_return_an_empty_typed_frame(monkeypatch):
+    backend = FakeBackend(json_rows(0), page_size=10, row_cap=4)
+    monkeypatch.setattr(data_generation, "backend", backend)
+
+    df = fetch_all_pages("get_filter_data", {}, FILTER_DTYPES)
+
+    assert df.empty
+    assert df.dtypes.astype(str).to_dict() == FILTER_DTYPES
@@ -0,0 +1,75 @@
+import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from shared_store import SharedStore, nbytes
+
+
+def frame(rows: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({"value": np.zeros(rows)})
+
+
+def test_concurrent_leases_load_once():
+    store = SharedStore(2**20)
+    loading = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        loading.set()
+        release.wait(5)
+        return frame()
+
+    with ThreadPoolExecutor(8) as executor:
+        first = executor.submit(store.lease, "key", load)
+        loading.wait(5)
+        others = [executor.submit(store.lease, "key", load) for _ in range(7)]
+        release.set()
+        leases = [first.result()] + [future.result() for future in others]
+
+    assert len(loads) == 1
+    assert all(lease.value is leases[0].value for lease in leases)
+    assert store.entries["key"].refs == 8
+    assert not store.loading
+
+
+def test_collected_lease_drops_its_ref():
+    store = SharedStore(2**20)
+    lease = store.lease("key", frame)
+    kept = store.lease("key", frame)
+    entry = store.entries["key"]
+    assert entry.refs == 2
+
+    del lease
+    gc.collect()
+    # Released refs are counted down on the next lease
+    store.lease("other", frame)
+
+    assert entry.refs == 1
+    assert kept.value is entry.value
+
+
+def test_eviction_keeps_leased_entries():
+    size = nbytes(frame())
+    store = SharedStore(2 * size)
+    oldest = store.lease("oldest", frame)
+    lease = store.lease("released", frame)
+    del lease
+    gc.collect()
+
+    # Over the limit with every entry leased, none can be evicted
+    leases = [store.lease(key, frame) for key in ("a", "b")]
+    assert list(store.entries) == ["oldest", "a", "b"]
+    assert store.nbytes == 3 * size
+
+    del leases
+    gc.collect()
+    store.lease("c", frame)
+
+    # The least recently used entry is still leased, the released ones go
+    assert list(store.entries) == ["oldest", "c"]
+    assert oldest.value is store.entries["oldest"].value
@@ -0,0 +1,134 @@
+"""Content-addressed on-disk cache for OpenAQ API responses."""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_DIR = os.getenv("OPENAQ_CACHE_DIR", ".cache/openaq")
+CACHE_MODE = os.getenv("OPENAQ_CACHE_MODE", "use")
+CACHE_TTL = float(os.getenv("OPENAQ_CACHE_TTL", str(24 * 3600)))
+CACHE_MAX_MB = float(os.getenv("OPENAQ_CACHE_MAX_MB", "500"))
+
+# use: serve fresh entries, fetch and store misses
+# cache-only: never touch the network, stale entries included
+# refresh: always fetch and overwrite entries
+# bypass: neither read nor write the cache
+CACHE_MODES = ("use", "cache-only", "refresh", "bypass")
+
+
+class CacheMissError(LookupError):
+    """Raised in cache-only mode when a response was never cached."""
+
+
+class ResponseCache:
+    """Stores JSON responses keyed by endpoint and query parameters.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: str = CACHE_DIR,
+        mode: str = CACHE_MODE,
+        ttl: float = CACHE_TTL,
+        max_bytes: int = int(CACHE_MAX_MB * 1e6),
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}"
+            )
+        self.directory = Path(directory)
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    @staticmethod
+    def key(endpoint: str, params: dict = None) -> str:
+        payload = json.dumps(
+            {"endpoint": endpoint, "params": params or {}}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def load(self, endpoint: str, params: dict = None) -> dict | None:
+        """Returns the cached response, or None when it has to be fetched.
+
+        Raises:
+            CacheMissError: If the response is not cached in cache-only mode.
+        """
+        if self.mode in ("refresh", "bypass"):
+            return None
+
+        path = self._path(self.key(endpoint, params))
+        try:
+            entry = json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        if entry is not None and (
+            self.mode == "cache-only" or time.time() - entry["stored_at"] < self.ttl
+        ):
+            self.hits += 1
+            os.utime(path)  # mark as recently used
+            return entry["response"]
+
+        self.misses += 1
+        if self.mode == "cache-only":
+            raise CacheMissError(f"No cached response for {endpoint} {params}")
+        return None
+
+    def store(self, endpoint: str, params: dict, response: dict):
+        if self.mode in ("cache-only", "bypass"):
+            return
+
+        path = self._path(self.key(endpoint, params))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "endpoint": endpoint,
+            "params": params,
+            "stored_at": time.time(),
+            "response": response,
+        }
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(entry))
+        previous_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = sum(p.stat().st_size for p in self.directory.glob("*/*.json"))
+        else:
+            self._size += path.stat().st_size - previous_size
+
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Removes least recently used entries until under 90% of the size limit."""
+        entries = sorted(
+            (p.stat().st_mtime, p.stat().st_size, p)
+            for p in self.directory.glob("*/*.json")
+        )
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+    def summary(self) -> str:
+        return f"Response cache ({self.mode}): {self.hits} hits, {self.misses} misses"
+
+
+response_cache = ResponseCache()
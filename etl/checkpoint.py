@@ -0,0 +1,86 @@
+"""Persists ETL progress so an interrupted run can resume where it stopped."""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHECKPOINT_DIR = os.getenv("ETL_CHECKPOINT_DIR", ".etl_checkpoint")
+
+
+class Checkpoint:
+    """Stages geocoded locations and fetched measurements on disk.
+
+    Measurements are written one batch of sensors per part file, alongside a
+    progress file listing the sensors fetched so far. A crash loses at most
+    the batch being fetched.
+    """
+
+    def __init__(self, directory: str = CHECKPOINT_DIR):
+        self.directory = Path(directory)
+        self.progress_path = self.directory / "progress.json"
+        self.locations_path = self.directory / "locations.pkl"
+
+        if self.progress_path.exists():
+            self.progress = json.loads(self.progress_path.read_text())
+        else:
+            self.progress = {"fetched_sensors": [], "parts": []}
+
+    @property
+    def fetched_sensors(self) -> set[int]:
+        return set(self.progress["fetched_sensors"])
+
+    def clear(self):
+        """Discards every staged result."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.progress = {"fetched_sensors": [], "parts": []}
+
+    def load_locations(self) -> pd.DataFrame | None:
+        """Returns the geocoded locations of a previous attempt, if any."""
+        if not self.locations_path.exists():
+            return None
+        return pd.read_pickle(self.locations_path)
+
+    def save_locations(self, locations_df: pd.DataFrame):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.locations_path.with_suffix(".tmp")
+        locations_df.to_pickle(tmp_path)
+        os.replace(tmp_path, self.locations_path)
+
+    def add_measurements(
+        self, sensor_ids: list[int], measurements_df: pd.DataFrame = None
+    ):
+        """Stages the measurements of a batch of sensors as a new part file.
+
+        The progress file is only replaced once the part is on disk. Without
+        measurements, the sensors are only recorded as done, for batches
+        already committed to the database by a streamed run.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        parts = list(self.progress["parts"])
+        if measurements_df is not None and not measurements_df.empty:
+            part_name = f"measurements_{len(parts):05d}.pkl"
+            measurements_df.to_pickle(self.directory / part_name)
+            parts.append(part_name)
+
+        progress = {
+            "fetched_sensors": self.progress["fetched_sensors"]
+            + [int(sensor_id) for sensor_id in sensor_ids],
+            "parts": parts,
+        }
+        tmp_path = self.progress_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(progress))
+        os.replace(tmp_path, self.progress_path)
+        self.progress = progress
+
+    def load_measurements(self) -> list[pd.DataFrame]:
+        """Returns the measurement batches staged by previous attempts."""
+        return [
+            pd.read_pickle(self.directory / part) for part in self.progress["parts"]
+        ]
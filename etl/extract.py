@@ -1,24 +1,27 @@
 """Handles data extraction from OpenAQ API and returns JSON responses."""
 
-import os
-
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-from dotenv import load_dotenv
-import httpx
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
-load_dotenv()
+import session
+from cache import CacheMissError, response_cache
 
-API_KEY = os.getenv("OPENAQ_API_KEY")
-BASE_URL = "https://api.openaq.org/v3/"
-HEADERS = {"X-API-Key": API_KEY}
 
 @retry(
     reraise=True,
     wait=wait_random_exponential(min=0.1, max=10),
     stop=stop_after_attempt(10),
+    retry=retry_if_not_exception_type(CacheMissError),
+    before_sleep=session.stats.record_retry,
 )
 def api_call(endpoint: str, params: dict = None) -> dict:
-    """Makes an API request to OpenAQ.
+    """Makes an API request to OpenAQ through the shared session.
+
+    Responses are served from the on-disk cache when possible.
 
     Args:
         endpoint (str): The API endpoint to query.
@@ -29,12 +32,18 @@ def api_call(endpoint: str, params: dict = None) -> dict:
 
     Raises:
         ValueError: If the request fails.
+        CacheMissError: If the response is not cached in cache-only mode.
     """
-    with httpx.Client(base_url=BASE_URL, headers=HEADERS) as client:
-        response = client.get(endpoint, params=params)
-        if response.status_code == 200:
-            return response.json()
-        raise ValueError(f"Request failed with status code: {response.status_code}")
+    cached_json = response_cache.load(endpoint, params)
+    if cached_json is not None:
+        return cached_json
+
+    response = session.request(endpoint, params)
+    if response.status_code == 200:
+        response_json = response.json()
+        response_cache.store(endpoint, params, response_json)
+        return response_json
+    raise ValueError(f"Request failed with status code: {response.status_code}")
 
 
 def extract_data() -> dict:
@@ -0,0 +1,208 @@
+"""Fetches sensor measurements concurrently while staying within OpenAQ quotas."""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+
+import httpx
+import pandas as pd
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+import session
+from cache import CacheMissError, response_cache
+
+MINUTE_LIMIT = 50
+HOUR_LIMIT = 1500
+MAX_IN_FLIGHT = 8
+# Seconds waited after a 429 response telling no time to wait
+RATE_LIMITED_WAIT = 60
+
+
+class SlidingWindow:
+    """Allows `limit` requests within any `period` seconds.
+
+    Send times are kept for a period, so unlike a token bucket starting full,
+    no window ever holds more than `limit` requests, bursts included.
+    """
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.sent = deque()
+
+    def wait_time(self, now: float) -> float:
+        """Returns the number of seconds until one more request fits."""
+        while self.sent and self.sent[0] <= now - self.period:
+            self.sent.popleft()
+        if len(self.sent) < self.limit:
+            return 0.0
+        return self.sent[0] + self.period - now
+
+    def record(self, now: float):
+        self.sent.append(now)
+
+
+class RateLimiter:
+    """Shares a set of sliding windows between all concurrent requests.
+
+    A request is only sent once it fits in every window, so the minute and
+    hour quotas are both respected without stalling in fixed-length sleeps.
+    A rate limited response pauses every request for the time it asks.
+    """
+
+    def __init__(
+        self,
+        *windows: SlidingWindow,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+    ):
+        self.windows = windows
+        self.clock = clock
+        self.sleep = sleep
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def openaq(cls) -> "RateLimiter":
+        return cls(SlidingWindow(MINUTE_LIMIT, 60), SlidingWindow(HOUR_LIMIT, 3600))
+
+    def wait_time(self) -> float:
+        now = self.clock()
+        return max(
+            self.paused_until - now,
+            *(window.wait_time(now) for window in self.windows),
+        )
+
+    async def acquire(self):
+        async with self._lock:
+            while (wait := self.wait_time()) > 0:
+                await self.sleep(wait)
+            now = self.clock()
+            for window in self.windows:
+                window.record(now)
+
+    def pause(self, seconds: float):
+        """Holds back every request for `seconds`."""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+def retry_after(response: httpx.Response) -> float:
+    """Returns the seconds to wait after a 429 response, as its headers ask."""
+    for header in ("retry-after", "x-ratelimit-reset"):
+        try:
+            return max(0.0, float(response.headers[header]))
+        except (KeyError, ValueError):
+            continue
+    return RATE_LIMITED_WAIT
+
+
+@retry(
+    reraise=True,
+    wait=wait_random_exponential(min=0.1, max=10),
+    stop=stop_after_attempt(10),
+    retry=retry_if_not_exception_type(CacheMissError),
+    before_sleep=session.stats.record_retry,
+)
+async def api_call_async(
+    limiter: RateLimiter,
+    endpoint: str,
+    params: dict = None,
+) -> dict:
+    """Makes a rate limited API request to OpenAQ through the shared session.
+
+    Cached responses are returned without going through the limiter. Every
+    network attempt, retries included, counts against the quota like OpenAQ
+    counts it. A 429 response pauses the limiter for its Retry-After delay
+    and is sent again, without counting as a failed attempt.
+
+    Args:
+        limiter (RateLimiter): Limiter shared by all in-flight requests.
+        endpoint (str): The API endpoint to query.
+        params (dict, optional): Query parameters for the API request.
+
+    Returns:
+        dict: The JSON response from the API.
+
+    Raises:
+        ValueError: If the request fails.
+        CacheMissError: If the response is not cached in cache-only mode.
+    """
+    cached_json = response_cache.load(endpoint, params)
+    if cached_json is not None:
+        return cached_json
+
+    # Rate limited attempts wait as asked instead of using up retries
+    while True:
+        await limiter.acquire()
+        response = await session.arequest(endpoint, params)
+        if response.status_code != 429:
+            break
+        limiter.pause(retry_after(response))
+    if response.status_code == 200:
+        response_json = response.json()
+        response_cache.store(endpoint, params, response_json)
+        return response_json
+    raise ValueError(f"Request failed with status code: {response.status_code}")
+
+
+async def fetch_sensor_measurements(
+    sensor_ids: Iterable[int],
+    watermarks: dict[int, pd.Timestamp] = None,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    limiter: RateLimiter = None,
+) -> AsyncIterator[tuple[int, list[dict]]]:
+    """Fetches monthly measurements for every sensor, keeping several requests in flight.
+
+    Args:
+        sensor_ids (Iterable[int]): IDs of the sensors to fetch.
+        watermarks (dict[int, pd.Timestamp], optional): Start of the last
+            loaded period per sensor. Only periods from it on are requested.
+        max_in_flight (int, optional): Maximum number of concurrent requests.
+        limiter (RateLimiter, optional): Limiter enforcing the API quota,
+            defaults to the OpenAQ minute and hour limits.
+
+    Yields:
+        tuple[int, list[dict]]: Sensor ID and its measurement records, in
+        completion order. At most `max_in_flight` responses are fetched ahead
+        of the consumer.
+    """
+    limiter = limiter or RateLimiter.openaq()
+    watermarks = watermarks or {}
+
+    async def fetch_one(sensor_id: int) -> tuple[int, list[dict]]:
+        params = {"limit": 1000}
+        if sensor_id in watermarks:
+            date_from = watermarks[sensor_id].date().isoformat()
+            params = {"limit": 100, "date_from": date_from}
+        measurements_json = await api_call_async(
+            limiter, f"sensors/{sensor_id}/days/monthly", params
+        )
+        return sensor_id, measurements_json.get("results", [])
+
+    # Requests are only started as results are consumed, so a slow consumer
+    # holds back fetching instead of piling up responses in memory.
+    remaining = iter(sensor_ids)
+    pending = set()
+    try:
+        while True:
+            for sensor_id in remaining:
+                pending.add(asyncio.create_task(fetch_one(sensor_id)))
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
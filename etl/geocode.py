@@ -0,0 +1,137 @@
+"""Reverse geocodes coordinates offline against the French communes reference."""
+
+import os
+from pathlib import Path
+
+import httpx
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from scipy.spatial import cKDTree
+
+load_dotenv()
+
+# Communes with their postcode, department and region, published on data.gouv.fr
+REFERENCE_URL = (
+    "https://www.data.gouv.fr/fr/datasets/r/dbe8a621-a9c4-4bc3-9cae-be1699c5ff25"
+)
+REFERENCE_PATH = os.getenv(
+    "COMMUNES_REFERENCE_PATH",
+    str(Path(__file__).parent / "data" / "communes-departement-region.csv"),
+)
+# INSEE codes of the arrondissements listed in the reference in place of
+# Paris, Lyon and Marseille, named after their commune as Nominatim did
+ARRONDISSEMENTS = [
+    (75101, 75120, "Paris"),
+    (69381, 69389, "Lyon"),
+    (13201, 13216, "Marseille"),
+]
+MAX_DISTANCE_KM = 20
+EARTH_RADIUS_KM = 6371.0
+
+
+def load_reference(path: str = REFERENCE_PATH) -> pd.DataFrame:
+    """Loads the communes reference file, downloading it on first use.
+
+    Returns:
+        pd.DataFrame: One row per commune or arrondissement with its town,
+        department, region, postcode, latitude and longitude.
+    """
+    path = Path(path)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        response = httpx.get(REFERENCE_URL, follow_redirects=True, timeout=60)
+        response.raise_for_status()
+        path.write_bytes(response.content)
+
+    reference = pd.read_csv(
+        path,
+        usecols=[
+            "code_commune_INSEE",
+            "nom_commune_complet",
+            "code_postal",
+            "nom_departement",
+            "nom_region",
+            "latitude",
+            "longitude",
+        ],
+        dtype={"code_commune_INSEE": str, "code_postal": str},
+    )
+    reference = reference.dropna(subset=["latitude", "longitude"])
+    reference = reference.drop_duplicates(subset="code_commune_INSEE")
+
+    # Arrondissements keep their own coordinates and postcode
+    towns = reference["nom_commune_complet"].copy()
+    codes = pd.to_numeric(reference["code_commune_INSEE"], errors="coerce")
+    for first_code, last_code, commune in ARRONDISSEMENTS:
+        towns[codes.between(first_code, last_code)] = commune
+
+    return pd.DataFrame(
+        {
+            "town": towns,
+            "department": reference["nom_departement"].fillna("Not_found"),
+            "region": reference["nom_region"].fillna("Not_found"),
+            "postcode": reference["code_postal"].fillna("00000"),
+            "latitude": reference["latitude"],
+            "longitude": reference["longitude"],
+        }
+    ).reset_index(drop=True)
+
+
+def to_unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Projects coordinates on the unit sphere so euclidean distance follows the globe."""
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+class OfflineGeocoder:
+    """Finds the nearest commune of each coordinate with a KD-tree."""
+
+    def __init__(self, reference: pd.DataFrame = None):
+        self.reference = load_reference() if reference is None else reference
+        self.tree = cKDTree(
+            to_unit_vectors(
+                self.reference["latitude"].to_numpy(),
+                self.reference["longitude"].to_numpy(),
+            )
+        )
+
+    def reverse(self, latitudes: pd.Series, longitudes: pd.Series) -> pd.DataFrame:
+        """Resolves the town, department, region and postcode of each coordinate.
+
+        Duplicate coordinates are only looked up once. Coordinates further than
+        MAX_DISTANCE_KM from any commune are marked as "Not_found".
+
+        Returns:
+            pd.DataFrame: One row per input coordinate, aligned on its index.
+        """
+        coordinates = pd.DataFrame(
+            {"latitude": latitudes.to_numpy(), "longitude": longitudes.to_numpy()}
+        )
+        unique_coordinates = coordinates.drop_duplicates().reset_index(drop=True)
+
+        chord, nearest = self.tree.query(
+            to_unit_vectors(
+                unique_coordinates["latitude"].to_numpy(),
+                unique_coordinates["longitude"].to_numpy(),
+            )
+        )
+        distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1))
+
+        matches = self.reference.iloc[nearest][
+            ["town", "department", "region", "postcode"]
+        ].reset_index(drop=True)
+        too_far = distance_km > MAX_DISTANCE_KM
+        matches.loc[too_far, ["town", "department", "region"]] = "Not_found"
+        matches.loc[too_far, "postcode"] = "00000"
+
+        resolved = coordinates.merge(
+            pd.concat([unique_coordinates, matches], axis=1),
+            on=["latitude", "longitude"],
+            how="left",
+        )
+        resolved.index = latitudes.index
+        return resolved[["town", "department", "region", "postcode"]]
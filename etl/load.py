@@ -1,35 +1,309 @@
 """Loads transformed data into PostgreSQL database."""
 
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import psycopg
 import pandas as pd
 from dotenv import load_dotenv
+from psycopg_pool import ConnectionPool
+from tqdm import tqdm
 
 load_dotenv()
 
-def get_connection():
-    return psycopg.connect(
-        dbname="airpollution_db",
-        user="postgres",
-        password=os.getenv("POSTGRES_PASSWORD"),
-        host="localhost",
-        port="5432",
+COPY_MIN_ROWS = 1000
+COPY_CHUNK_ROWS = 50_000
+LOAD_WORKERS = int(os.getenv("ETL_LOAD_WORKERS", "4"))
+
+# Tables referenced by the foreign keys of each table
+TABLE_DEPENDENCIES = {
+    "countries": [],
+    "pollutants": [],
+    "locations": ["countries"],
+    "sensors": ["locations", "pollutants"],
+    "measurements": ["sensors"],
+}
+
+# Natural key used to merge rows of each table on upsert
+UPSERT_KEYS = {
+    "countries": ["id"],
+    "pollutants": ["id"],
+    "locations": ["id"],
+    "sensors": ["id"],
+    "measurements": ["sensor_id", "datetimeFrom"],
+}
+
+
+CONNECTION_KWARGS = {
+    "dbname": "airpollution_db",
+    "user": "postgres",
+    "password": os.getenv("POSTGRES_PASSWORD"),
+    "host": "localhost",
+    "port": "5432",
+}
+
+_pool = None
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, opening it on first use."""
+    global _pool
+    if _pool is None or _pool.closed:
+        _pool = ConnectionPool(
+            kwargs=CONNECTION_KWARGS, min_size=1, max_size=LOAD_WORKERS, open=True
+        )
+    return _pool
+
+
+def close_pool():
+    if _pool is not None:
+        _pool.close()
+
+
+def load_tables(tables: dict[str, pd.DataFrame], upsert: bool = False):
+    """Loads every table concurrently, each one after the tables it references.
+
+    Tables are scheduled on LOAD_WORKERS threads sharing the connection pool
+    as soon as their dependencies in TABLE_DEPENDENCIES are loaded, so
+    independent tables load side by side. A failed table stops the load before
+    any table depending on it starts.
+    """
+    done = set()
+    pending = dict(tables)
+    running = {}
+
+    with (
+        ThreadPoolExecutor(LOAD_WORKERS) as executor,
+        tqdm(total=len(tables), desc="Loading data", unit="table") as progress,
+    ):
+        while pending or running:
+            for table_name in list(pending):
+                dependencies = set(TABLE_DEPENDENCIES.get(table_name, [])) & set(tables)
+                if dependencies <= done:
+                    df = pending.pop(table_name)
+                    future = executor.submit(load_data, table_name, df, upsert)
+                    running[future] = table_name
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table_name = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                done.add(table_name)
+                progress.update()
+
+
+def load_data(table_name: str, df: pd.DataFrame, upsert: bool = False):
+    """Loads a DataFrame into a PostgreSQL table and reports the load rate.
+
+    Rows are streamed with COPY, split into parallel streams once the table
+    spans several COPY_CHUNK_ROWS chunks. Tables smaller than COPY_MIN_ROWS
+    are simply inserted with executemany. With `upsert`, rows are merged
+    through a staging table instead, so reloading the same data is idempotent.
+    """
+    start = time.perf_counter()
+
+    if not upsert and len(df) > COPY_CHUNK_ROWS:
+        copy_rows_parallel(table_name, df)
+    else:
+        write_rows(table_name, df, upsert)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Loaded {len(df)} rows into {table_name} in {elapsed:.2f}s "
+        f"({len(df) / elapsed:,.0f} rows/s)"
     )
 
 
-def load_data(table_name: str, df: pd.DataFrame):
-    """Inserts data into PostgreSQL database."""
-    conn = get_connection()
-    cursor = conn.cursor()
+def write_rows(table_name: str, df: pd.DataFrame, upsert: bool = False):
+    """Writes the DataFrame in a single transaction on a pool connection."""
+    create_partitions(table_name, df)
+    with get_pool().connection() as conn, conn.cursor() as cursor:
+        if upsert:
+            upsert_rows(cursor, table_name, df)
+        elif len(df) < COPY_MIN_ROWS:
+            insert_rows(cursor, table_name, df)
+        else:
+            copy_rows(cursor, table_name, df)
+
 
+def create_partitions(table_name: str, df: pd.DataFrame):
+    """Creates the monthly partitions the measurements are about to be written to.
+
+    They are committed on their own beforehand, since creating a partition
+    locks the whole table.
+    """
+    if table_name != "measurements" or df.empty:
+        return
+    start, end = to_python_values(df["datetimeFrom"].agg(["min", "max"]))
+    with get_pool().connection() as conn:
+        conn.execute("SELECT create_measurement_partitions(%s, %s)", [start, end])
+
+
+def insert_rows(cursor: psycopg.Cursor, table_name: str, df: pd.DataFrame):
+    """Inserts the DataFrame with executemany, values converted as by copy_rows.
+
+    Timestamps are sent naive like COPY sends them, aware ones would be
+    shifted to the session time zone when stored in TIMESTAMP columns.
+    """
     placeholders = ", ".join(["%s"] * len(df.columns))
     columns = ", ".join(df.columns)
     sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+    cursor.executemany(sql, zip(*(to_python_values(df[column]) for column in df)))
+
+
+def copy_rows(cursor: psycopg.Cursor, table_name: str, df: pd.DataFrame):
+    """Streams the DataFrame into the table with a binary COPY FROM STDIN.
+
+    Rows are converted one chunk at a time, so only a chunk is ever held in
+    memory besides the DataFrame itself.
+    """
+    columns = ", ".join(df.columns)
+    cursor.execute(f"SELECT {columns} FROM {table_name} LIMIT 0")
+    column_types = [column.type_code for column in cursor.description]
+
+    sql = f"COPY {table_name} ({columns}) FROM STDIN (FORMAT BINARY)"
+    with cursor.copy(sql) as copy:
+        copy.set_types(column_types)
+        for start in range(0, len(df), COPY_CHUNK_ROWS):
+            chunk = df.iloc[start : start + COPY_CHUNK_ROWS]
+            for row in zip(*(to_python_values(chunk[column]) for column in df)):
+                copy.write_row(row)
+
+
+def copy_rows_parallel(table_name: str, df: pd.DataFrame):
+    """COPYs contiguous slices of the DataFrame over several pool connections.
+
+    Each stream commits on its own, so a failed stream leaves the slices
+    already copied in place. Rerun with upsert to complete such a load.
+    """
+    create_partitions(table_name, df)
+    streams = min(LOAD_WORKERS, -(-len(df) // COPY_CHUNK_ROWS))
+    bounds = [len(df) * stream // streams for stream in range(streams + 1)]
+
+    def copy_slice(start: int, stop: int):
+        with get_pool().connection() as conn, conn.cursor() as cursor:
+            copy_rows(cursor, table_name, df.iloc[start:stop])
+
+    with ThreadPoolExecutor(streams) as executor:
+        futures = [
+            executor.submit(copy_slice, start, stop)
+            for start, stop in zip(bounds, bounds[1:])
+        ]
+        for future in futures:
+            future.result()
+
+
+def upsert_rows(cursor: psycopg.Cursor, table_name: str, df: pd.DataFrame):
+    """Merges the DataFrame into the table through a temporary staging table.
+
+    Rows are COPYed into the staging table, then inserted with
+    ON CONFLICT ... DO UPDATE on the table's natural key. Conflicting rows are
+    only rewritten when one of their values changed. Tables keyed on something
+    other than `id` let the database assign IDs to new rows.
+    """
+    keys = UPSERT_KEYS[table_name]
+    if "id" not in keys:
+        df = df.drop(columns="id")
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+            f"COALESCE(MAX(id), 0) + 1, false) FROM {table_name}"
+        )
+
+    stage_name = f"stage_{table_name}"
+    columns = ", ".join(df.columns)
+    key_columns = ", ".join(keys)
+    updated = [column for column in df.columns if column not in keys]
+    assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in updated)
+    current = ", ".join(f"{table_name}.{column}" for column in updated)
+    excluded = ", ".join(f"EXCLUDED.{column}" for column in updated)
+
+    cursor.execute(
+        f"CREATE TEMP TABLE {stage_name} ON COMMIT DROP AS "
+        f"SELECT {columns} FROM {table_name} WITH NO DATA"
+    )
+    copy_rows(cursor, stage_name, df)
+    # Counted beforehand, partitioned tables cannot return xmax to tell them apart
+    (inserted,) = cursor.execute(f"""
+        SELECT COUNT(*) FILTER (WHERE {table_name}.{keys[0]} IS NULL)
+        FROM (SELECT DISTINCT {key_columns} FROM {stage_name}) AS staged
+        LEFT JOIN {table_name} USING ({key_columns})
+        """).fetchone()
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({columns})
+        SELECT DISTINCT ON ({key_columns}) {columns} FROM {stage_name}
+        ON CONFLICT ({key_columns}) DO UPDATE SET {assignments}
+        WHERE ({current}) IS DISTINCT FROM ({excluded})
+        """)
+    print(
+        f"Upserted {table_name}: {inserted} inserted, "
+        f"{cursor.rowcount - inserted} updated, {len(df) - cursor.rowcount} unchanged"
+    )
+
+
+def to_python_values(series: pd.Series) -> list:
+    """Converts a column to Python values, timestamps as naive UTC datetimes."""
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        series = series.dt.tz_convert(None)
+    if series.dtype.kind == "M":
+        return list(series.dt.to_pydatetime())
+    return series.tolist()
+
+
+def refresh_rollups(since: pd.Timestamp = None):
+    """Recomputes the monthly measurement rollups from `since` on.
+
+    Only the months holding newly loaded measurements need recomputing after
+    an incremental load, every month is rebuilt when `since` is None.
+    """
+    start = time.perf_counter()
+    if since is not None:
+        since = since.tz_convert(None).to_pydatetime()
+    with get_pool().connection() as conn:
+        conn.execute("SELECT refresh_measurement_rollups(%s)", [since])
+    print(f"Refreshed measurement rollups in {time.perf_counter() - start:.2f}s")
+
+
+def refresh_views():
+    """Refreshes the materialized dashboard views without blocking readers."""
+    start = time.perf_counter()
+    with get_pool().connection() as conn:
+        conn.execute("SELECT refresh_dashboard_views()")
+    print(f"Refreshed dashboard views in {time.perf_counter() - start:.2f}s")
+
+
+def record_run(incremental: bool, measurements: int):
+    """Logs a completed run, which invalidates the dashboard caches."""
+    with get_pool().connection() as conn:
+        conn.execute(
+            "INSERT INTO etl_runs (incremental, measurements) VALUES (%s, %s)",
+            [incremental, measurements],
+        )
+
+
+def get_watermarks() -> dict[int, pd.Timestamp]:
+    """Returns the `datetimeFrom` (UTC) of the latest loaded period of every sensor."""
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            "SELECT sensor_id, MAX(datetimeFrom) FROM measurements GROUP BY sensor_id"
+        ).fetchall()
+    return {sensor_id: pd.Timestamp(last, tz="UTC") for sensor_id, last in rows}
+
 
-    data_tuples = [tuple(row) for row in df.to_numpy()]
+def get_next_id(table_name: str) -> int:
+    """Returns the first ID available after the rows already loaded."""
+    with get_pool().connection() as conn:
+        (max_id,) = conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()
+    return 0 if max_id is None else max_id + 1
 
-    cursor.executemany(sql, data_tuples)
-    conn.commit()
 
-    cursor.close()
-    conn.close()
+def filter_new_rows(table_name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Keeps the rows whose ID is not loaded in the table yet."""
+    with get_pool().connection() as conn:
+        loaded_ids = {row[0] for row in conn.execute(f"SELECT id FROM {table_name}")}
+    return df[~df["id"].isin(loaded_ids)]
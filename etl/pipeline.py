@@ -0,0 +1,128 @@
+"""Streams measurements from the API into the database batch by batch."""
+
+import asyncio
+import os
+import time
+
+import pandas as pd
+from tqdm import tqdm
+
+import session
+from checkpoint import Checkpoint
+from fetch import fetch_sensor_measurements
+from load import write_rows
+from staging import Staging
+from transform import BATCH_SIZE, MEASUREMENT_COLUMNS, normalize_measurements
+
+# Normalized batches waiting to be written, beyond it fetching is held back
+QUEUE_SIZE = int(os.getenv("ETL_QUEUE_SIZE", "2"))
+
+
+async def stream_measurements(
+    sensor_ids: list[int],
+    watermarks: dict[int, pd.Timestamp] = None,
+    id_offset: int = 0,
+    upsert: bool = False,
+    checkpoint: Checkpoint = None,
+    staging: Staging = None,
+    queue_size: int = QUEUE_SIZE,
+) -> tuple[int, pd.Timestamp | None]:
+    """Fetches, normalizes and loads measurements as a pipeline.
+
+    Responses are normalized every BATCH_SIZE sensors and handed to a writer
+    through a bounded queue. The writer commits each batch on its own, so rows
+    are queryable as soon as their batch is written, and fetching pauses
+    whenever the database falls behind. Memory holds at most `queue_size`
+    batches plus the responses in flight, however many sensors are fetched.
+
+    Args:
+        sensor_ids (list[int]): IDs of the sensors to fetch.
+        watermarks (dict[int, pd.Timestamp], optional): Start of the last
+            loaded period per sensor, only periods from it on are kept.
+        id_offset (int, optional): First measurement ID to assign.
+        upsert (bool, optional): Merge batches on their natural key.
+        checkpoint (Checkpoint, optional): Records the sensors of each
+            committed batch, skipped when resuming.
+        staging (Staging, optional): Run to which each batch is also
+            staged as Parquet once written, its sensors being staged.
+        queue_size (int, optional): Maximum number of batches waiting to be
+            written.
+
+    Returns:
+        tuple[int, pd.Timestamp | None]: Number of measurements written and
+        the earliest `datetimeFrom` among them.
+    """
+    watermarks = watermarks or {}
+    if checkpoint:
+        fetched_sensors = checkpoint.fetched_sensors
+        sensor_ids = [id_ for id_ in sensor_ids if id_ not in fetched_sensors]
+
+    batches = asyncio.Queue(maxsize=queue_size)
+    next_id = id_offset
+    written = 0
+    earliest = None
+
+    async def produce():
+        batch_sensors, batch_sensor_ids, batch_records = [], [], []
+
+        async def flush_batch():
+            nonlocal next_id
+            measurements_df = normalize_measurements(
+                batch_sensor_ids, batch_records, watermarks
+            ).reset_index(drop=True)
+            measurements_df["id"] = range(next_id, next_id + len(measurements_df))
+            next_id += len(measurements_df)
+            await batches.put((list(batch_sensors), measurements_df))
+            batch_sensors.clear()
+            batch_sensor_ids.clear()
+            batch_records.clear()
+
+        with tqdm(
+            total=len(sensor_ids), desc="Streaming sensors", unit="sensor"
+        ) as bar:
+            async for sensor_id, results in fetch_sensor_measurements(
+                sensor_ids, watermarks
+            ):
+                bar.update()
+                batch_sensors.append(sensor_id)
+                batch_sensor_ids += [sensor_id] * len(results)
+                batch_records += results
+                if len(batch_sensors) >= BATCH_SIZE:
+                    await flush_batch()
+            if batch_sensors:
+                await flush_batch()
+        await batches.put(None)
+
+    async def consume():
+        nonlocal written, earliest
+        while (batch := await batches.get()) is not None:
+            batch_sensors, measurements_df = batch
+            measurements_df = measurements_df[MEASUREMENT_COLUMNS]
+            if not measurements_df.empty:
+                await asyncio.to_thread(
+                    write_rows, "measurements", measurements_df, upsert
+                )
+                batch_earliest = measurements_df["datetimeFrom"].min()
+                earliest = min(earliest or batch_earliest, batch_earliest)
+            written += len(measurements_df)
+            # Staged once written, along with the checkpoint, so that a batch
+            # failing to write is neither staged nor skipped when resuming
+            if staging:
+                await asyncio.to_thread(staging.add_measurements, measurements_df)
+            if checkpoint:
+                checkpoint.add_measurements(batch_sensors)
+
+    start = time.perf_counter()
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(produce())
+            group.create_task(consume())
+    finally:
+        await session.aclose()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Streamed {written} rows into measurements in {elapsed:.2f}s "
+        f"({written / elapsed:,.0f} rows/s)"
+    )
+    return written, earliest
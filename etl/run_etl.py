@@ -1,19 +1,181 @@
-from tqdm import tqdm
+import argparse
+import asyncio
 
+import pandas as pd
+
+import session
+from cache import response_cache
+from checkpoint import Checkpoint
 from extract import extract_data
-from transform import transform_data
-from load import load_data
+from pipeline import stream_measurements
+from transform import select_sensors, transform_data, transform_dimensions
+from load import (
+    close_pool,
+    filter_new_rows,
+    get_next_id,
+    get_watermarks,
+    load_tables,
+    record_run,
+    refresh_rollups,
+    refresh_views,
+)
+from snapshot import export_snapshot
+from staging import Staging, read_staged_tables
+
+
+def run(
+    incremental: bool = False,
+    resume: bool = False,
+    upsert: bool = False,
+    stream: bool = False,
+    snapshot: bool = False,
+    from_staging: str = None,
+):
+    """Runs the ETL.
+
+    An incremental run only requests measurements from the last loaded month
+    of each sensor on, since that month may have been partial when loaded,
+    merges them on their natural key and appends any new dimension rows.
+
+    An upsert run merges every table on its key instead of appending, so it
+    can be repeated without violating keys or duplicating measurements.
+
+    A streamed run loads the dimension tables first, then writes measurements
+    batch by batch while they are fetched instead of holding them all in
+    memory until the end.
+
+    The monthly measurement rollups are refreshed once loaded, only from the
+    earliest loaded month on when incremental, then the dashboard views. The
+    run is logged last, which invalidates the dashboard caches.
+
+    With `snapshot`, the tables read by the dashboard are then exported to
+    Parquet for its local DuckDB backend.
+
+    Progress is checkpointed on disk while transforming. A resumed run reuses
+    the geocoded locations and skips the sensors staged by the interrupted
+    one, otherwise any previous checkpoint is discarded. It only inserts the
+    dimension rows not loaded yet and merges measurements on their natural
+    key, since the interrupted run may have committed some of them.
+
+    The transformed tables are staged as Parquet, measurements partitioned by
+    pollutant and month. A run given `from_staging` loads the tables of such a
+    staged run instead of extracting and transforming them again, e.g. into
+    another database.
+    """
+    checkpoint = Checkpoint()
+    if not resume:
+        checkpoint.clear()
+    staging = None
+
+    if from_staging:
+        stream = False
+        transformed_data = read_staged_tables(from_staging)
+    else:
+        staging = Staging.resume() if resume else Staging()
+        extracted_data = extract_data()
+        watermarks = get_watermarks() if incremental else None
+
+        if stream:
+            transformed_data = transform_dimensions(extracted_data, checkpoint)
+            sensors_df = select_sensors(transformed_data, watermarks)
+        elif incremental:
+            transformed_data = transform_data(
+                extracted_data,
+                watermarks,
+                get_next_id("measurements"),
+                checkpoint=checkpoint,
+            )
+        else:
+            transformed_data = transform_data(extracted_data, checkpoint=checkpoint)
+        staging.write_tables(transformed_data)
+
+    # Tables loaded by an interrupted run are committed, their rows are left out
+    if (incremental or resume) and not upsert:
+        for table in ["countries", "pollutants", "locations", "sensors"]:
+            transformed_data[table] = filter_new_rows(table, transformed_data[table])
+    # Measurements may be partly committed, batch by batch or COPY slice by
+    # slice, a resumed run merges them on their natural key instead, as does
+    # an incremental run refreshing the last loaded month
+    upsert_measurements = upsert or resume or incremental
 
+    measurements_df = transformed_data.pop("measurements", None)
+    load_tables(transformed_data, upsert)
+    if measurements_df is not None:
+        load_tables({"measurements": measurements_df}, upsert_measurements)
+        transformed_data["measurements"] = measurements_df
 
-def run():
-    extracted_data = extract_data()
-    transformed_data = transform_data(extracted_data)
+    if stream:
+        loaded, loaded_from = asyncio.run(
+            stream_measurements(
+                sensors_df["id"].tolist(),
+                watermarks,
+                get_next_id("measurements"),
+                upsert_measurements,
+                checkpoint,
+                staging,
+            )
+        )
+    else:
+        loaded = len(transformed_data["measurements"])
+        loaded_from = transformed_data["measurements"]["datetimeFrom"].min()
+    if staging:
+        staging.finish(incremental)
 
-    for table, df in tqdm(transformed_data.items(), desc="Loading data", unit="table"):
-        load_data(table, df)
+    if not incremental:
+        refresh_rollups()
+    elif pd.notna(loaded_from):
+        refresh_rollups(loaded_from)
+    refresh_views()
+    record_run(incremental, loaded)
+    if snapshot:
+        export_snapshot()
 
+    checkpoint.clear()
+    session.close()
+    close_pool()
     print("✅ Data loaded successfully!")
+    print(session.stats.summary())
+    print(response_cache.summary())
 
 
 if __name__ == "__main__":
-    data = run()
+    parser = argparse.ArgumentParser(description="Run the air pollution ETL.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only fetch measurements from the last loaded month on and merge them",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume an interrupted run from its checkpoint",
+    )
+    parser.add_argument(
+        "--upsert",
+        action="store_true",
+        help="merge rows into existing tables instead of inserting them",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="load measurements batch by batch while they are fetched",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="export the dashboard tables to Parquet for the local backend",
+    )
+    parser.add_argument(
+        "--from-staging",
+        metavar="PATH",
+        help="load the tables of a staged run instead of fetching them",
+    )
+    args = parser.parse_args()
+    data = run(
+        incremental=args.incremental,
+        resume=args.resume,
+        upsert=args.upsert,
+        stream=args.stream,
+        snapshot=args.snapshot,
+        from_staging=args.from_staging,
+    )
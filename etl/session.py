@@ -0,0 +1,146 @@
+"""Long-lived, pooled HTTP sessions shared by every OpenAQ caller."""
+
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+API_KEY = os.getenv("OPENAQ_API_KEY")
+BASE_URL = "https://api.openaq.org/v3/"
+HEADERS = {"X-API-Key": API_KEY}
+
+HTTP2 = os.getenv("OPENAQ_HTTP2", "false").lower() == "true"
+MAX_CONNECTIONS = int(os.getenv("OPENAQ_MAX_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAQ_KEEPALIVE_EXPIRY", "60"))
+TIMEOUT = float(os.getenv("OPENAQ_TIMEOUT", "30"))
+
+
+class SessionStats:
+    """Counters collected from every request sent through the shared sessions."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.connections = 0
+        self.latencies = []
+        self.bytes_downloaded = 0
+        self.bytes_decoded = 0
+
+    def record_response(self, response: httpx.Response, latency: float):
+        self.requests += 1
+        self.latencies.append(latency)
+        self.bytes_downloaded += response.num_bytes_downloaded
+        self.bytes_decoded += len(response.content)
+
+    def record_retry(self, retry_state=None):
+        """Tenacity `before_sleep` hook counting retried attempts."""
+        self.retries += 1
+
+    @property
+    def handshakes_avoided(self) -> int:
+        """Requests served over an already open connection."""
+        return max(self.requests - self.connections, 0)
+
+    @property
+    def bytes_saved(self) -> int:
+        """Bytes spared on the wire by compressed transfer."""
+        return max(self.bytes_decoded - self.bytes_downloaded, 0)
+
+    def summary(self) -> str:
+        if not self.latencies:
+            return "HTTP session: no requests sent."
+        latencies = sorted(self.latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        return (
+            f"HTTP session: {self.requests} requests, {self.retries} retries, "
+            f"{self.connections} connections ({self.handshakes_avoided} handshakes avoided)\n"
+            f"Latency: p50 {statistics.median(self.latencies) * 1000:.0f}ms, "
+            f"p95 {p95 * 1000:.0f}ms\n"
+            f"Downloaded {self.bytes_downloaded / 1e6:.1f} MB "
+            f"({self.bytes_saved / 1e6:.1f} MB saved by compression)"
+        )
+
+
+stats = SessionStats()
+
+_client = None
+_async_client = None
+_async_client_loop = None
+
+
+def _client_options() -> dict:
+    return {
+        "base_url": BASE_URL,
+        "headers": HEADERS,
+        "http2": HTTP2,
+        "timeout": TIMEOUT,
+        "limits": httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def _trace(event_name: str, info: dict):
+    if event_name == "connection.connect_tcp.complete":
+        stats.connections += 1
+
+
+async def _atrace(event_name: str, info: dict):
+    _trace(event_name, info)
+
+
+def get_client() -> httpx.Client:
+    """Returns the process-wide client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.Client(**_client_options())
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the async client bound to the running event loop."""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if (
+        _async_client is None
+        or _async_client.is_closed
+        or _async_client_loop is not loop
+    ):
+        _async_client = httpx.AsyncClient(**_client_options())
+        _async_client_loop = loop
+    return _async_client
+
+
+def request(endpoint: str, params: dict = None) -> httpx.Response:
+    """Sends a GET request through the shared client and records its stats."""
+    start = time.perf_counter()
+    response = get_client().get(endpoint, params=params, extensions={"trace": _trace})
+    stats.record_response(response, time.perf_counter() - start)
+    return response
+
+
+async def arequest(endpoint: str, params: dict = None) -> httpx.Response:
+    """Sends a GET request through the shared async client and records its stats."""
+    start = time.perf_counter()
+    response = await get_async_client().get(
+        endpoint, params=params, extensions={"trace": _atrace}
+    )
+    stats.record_response(response, time.perf_counter() - start)
+    return response
+
+
+def close():
+    if _client is not None:
+        _client.close()
+
+
+async def aclose():
+    if _async_client is not None:
+        await _async_client.aclose()
@@ -0,0 +1,101 @@
+"""Exports the tables read by the dashboard to Parquet for its local backend."""
+
+import os
+import time
+from pathlib import Path
+
+import psycopg
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from load import COPY_CHUNK_ROWS, close_pool, get_pool
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR", str(Path(__file__).parent.parent / "data" / "snapshot")
+)
+
+# Tables and views queried by the dashboard. etl_runs comes last since the
+# dashboard caches are keyed on its latest run.
+SNAPSHOT_TABLES = [
+    "pollutants",
+    "locations",
+    "measurement_rollups",
+    "measurement_details",
+    "etl_runs",
+]
+
+# Row order of each file, keyset pages then only read consecutive row groups
+SNAPSHOT_ORDER = {"measurement_details": "datetimeFrom, id"}
+
+ARROW_TYPES = {
+    "bool": pa.bool_(),
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    "numeric": pa.float64(),
+    "text": pa.string(),
+    "varchar": pa.string(),
+    "bpchar": pa.string(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp("us"),
+}
+
+
+def export_snapshot(directory: str = SNAPSHOT_DIR):
+    """Writes every table of SNAPSHOT_TABLES to `{directory}/{table}.parquet`.
+
+    Tables are read within a single repeatable read transaction, so the files
+    are consistent with each other. Each file is written aside and swapped in
+    once every table is exported, so the dashboard never reads a partial one.
+    """
+    start = time.perf_counter()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    tmp_paths = {}
+    with get_pool().connection() as conn:
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        for table_name in SNAPSHOT_TABLES:
+            tmp_paths[table_name] = directory / f"{table_name}.parquet.tmp"
+            export_table(conn, table_name, tmp_paths[table_name])
+
+    for table_name, tmp_path in tmp_paths.items():
+        os.replace(tmp_path, directory / f"{table_name}.parquet")
+    print(f"Exported snapshot to {directory} in {time.perf_counter() - start:.2f}s")
+
+
+def export_table(conn: psycopg.Connection, table_name: str, path: Path):
+    """Streams a table into a Parquet file, one row group per COPY_CHUNK_ROWS rows."""
+    query = f"SELECT * FROM {table_name}"
+    if table_name in SNAPSHOT_ORDER:
+        query += f" ORDER BY {SNAPSHOT_ORDER[table_name]}"
+
+    # A server-side cursor keeps a single chunk of rows in memory
+    with conn.cursor(name=f"export_{table_name}") as cursor:
+        cursor.itersize = COPY_CHUNK_ROWS
+        cursor.execute(query)
+        schema = pa.schema(
+            (column.name, ARROW_TYPES[conn.adapters.types[column.type_code].name])
+            for column in cursor.description
+        )
+        with pq.ParquetWriter(path, schema) as writer:
+            while rows := cursor.fetchmany(COPY_CHUNK_ROWS):
+                writer.write_batch(
+                    pa.record_batch(
+                        [
+                            pa.array(values, type=field.type)
+                            for values, field in zip(zip(*rows), schema)
+                        ],
+                        schema=schema,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    export_snapshot()
+    close_pool()
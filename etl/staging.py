@@ -0,0 +1,177 @@
+"""Stages the transformed tables of each run as Parquet datasets."""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STAGING_DIR = os.getenv(
+    "ETL_STAGING_DIR", str(Path(__file__).parent / "data" / "staging")
+)
+
+MEASUREMENT_PARTITIONING = ["pollutant_id", "month"]
+
+
+class Staging:
+    """Writes the tables transformed by one run under `{directory}/{run_name}`.
+
+    Dimension tables are single Parquet files. Measurements are a dataset
+    partitioned hive-style by pollutant and month of the period midpoint, so
+    readers only open the files of the pollutants and months they scan, and
+    streamed batches are appended as new parts.
+
+    The manifest lists every file with its row count and is replaced after
+    each write. Files not listed in it, left by an interrupted write, are
+    ignored when reading, and a run is only complete once `finish` is called.
+    """
+
+    def __init__(self, run_name: str = None, directory: str = STAGING_DIR):
+        self.run_name = run_name or pd.Timestamp.now(tz="UTC").strftime(
+            "%Y%m%dT%H%M%SZ"
+        )
+        self.path = Path(directory) / self.run_name
+        self.manifest_path = self.path / "manifest.json"
+        # Pollutant of each sensor, set once the sensors table is staged
+        self.sensor_pollutants = None
+
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+        else:
+            self.manifest = {
+                "run": self.run_name,
+                "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+                "complete": False,
+                "tables": {},
+            }
+
+    @classmethod
+    def resume(cls, directory: str = STAGING_DIR) -> "Staging":
+        """Reopens the latest incomplete run, or starts a new one."""
+        manifest_paths = sorted(Path(directory).glob("*/manifest.json"))
+        if manifest_paths:
+            manifest = json.loads(manifest_paths[-1].read_text())
+            if not manifest["complete"]:
+                return cls(manifest["run"], directory)
+        return cls(directory=directory)
+
+    def write_tables(self, tables: dict[str, pd.DataFrame]):
+        """Stages every table, measurements replacing any staged before.
+
+        Sensors have to be staged before or along with measurements.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        for table_name, df in tables.items():
+            if table_name == "measurements":
+                shutil.rmtree(self.path / "measurements", ignore_errors=True)
+                self.manifest["tables"].pop("measurements", None)
+                self.add_measurements(df)
+                continue
+            if table_name == "sensors":
+                self.sensor_pollutants = df.set_index("id")["pollutant_id"]
+
+            file_name = f"{table_name}.parquet"
+            df.to_parquet(self.path / file_name, index=False)
+            self.manifest["tables"][table_name] = {
+                "rows": len(df),
+                "files": [{"path": file_name, "rows": len(df)}],
+            }
+            self._write_manifest()
+
+    def add_measurements(self, measurements_df: pd.DataFrame):
+        """Appends a batch of measurements to the partitioned dataset."""
+        entry = self.manifest["tables"].setdefault(
+            "measurements",
+            {"rows": 0, "partitioning": MEASUREMENT_PARTITIONING, "files": []},
+        )
+        dataset_path = self.path / "measurements"
+        dataset_path.mkdir(parents=True, exist_ok=True)
+
+        table = pa.Table.from_pandas(measurements_df, preserve_index=False)
+        # The schema alone, so that readers get the columns without any part
+        if not (dataset_path / "_common_metadata").exists():
+            pq.write_metadata(table.schema, dataset_path / "_common_metadata")
+        if measurements_df.empty:
+            self._write_manifest()
+            return
+
+        pollutant_ids = measurements_df["sensor_id"].map(self.sensor_pollutants)
+        # Month of the period midpoint, as in the rollups, since UTC periods
+        # start on the last evening of the previous month
+        midpoints = (
+            measurements_df["datetimeFrom"]
+            + (measurements_df["datetimeTo"] - measurements_df["datetimeFrom"]) / 2
+        )
+        table = table.append_column(
+            "pollutant_id", pa.array(pollutant_ids, type=pa.int64())
+        ).append_column("month", pa.array(midpoints.dt.strftime("%Y-%m")))
+
+        written = []
+        ds.write_dataset(
+            table,
+            dataset_path,
+            format="parquet",
+            partitioning=MEASUREMENT_PARTITIONING,
+            partitioning_flavor="hive",
+            basename_template=f"part-{len(entry['files']):05d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_visitor=lambda file: written.append(
+                {
+                    "path": Path(file.path).relative_to(self.path).as_posix(),
+                    "rows": file.metadata.num_rows,
+                }
+            ),
+        )
+        entry["files"] += sorted(written, key=lambda file: file["path"])
+        entry["rows"] += len(measurements_df)
+        self._write_manifest()
+
+    def finish(self, incremental: bool = False):
+        """Marks the run complete once every table is staged."""
+        self.manifest["incremental"] = incremental
+        self.manifest["complete"] = True
+        self._write_manifest()
+        print(f"Staged run {self.run_name} in {self.path}")
+
+    def _write_manifest(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.manifest, indent=2))
+        os.replace(tmp_path, self.manifest_path)
+
+
+def read_staged_tables(path: str) -> dict[str, pd.DataFrame]:
+    """Reads back the tables of a complete staged run, as transformed.
+
+    Only the files listed in the manifest are read. Measurements come back
+    without their partition columns, ordered by ID.
+
+    Raises:
+        ValueError: If the run was not staged completely.
+    """
+    path = Path(path)
+    manifest = json.loads((path / "manifest.json").read_text())
+    if not manifest["complete"]:
+        raise ValueError(f"Staged run {manifest['run']} is incomplete")
+
+    tables = {}
+    for table_name, entry in manifest["tables"].items():
+        if table_name != "measurements":
+            tables[table_name] = pd.read_parquet(path / entry["files"][0]["path"])
+            continue
+
+        schema = pq.read_schema(path / "measurements" / "_common_metadata")
+        table = ds.dataset(
+            [(path / file["path"]).as_posix() for file in entry["files"]],
+            schema=schema,
+            format="parquet",
+        ).to_table()
+        tables[table_name] = table.to_pandas().sort_values("id").reset_index(drop=True)
+    return tables
@@ -0,0 +1,85 @@
+import asyncio
+from bisect import bisect_left
+
+import httpx
+
+import fetch
+import session
+from fetch import HOUR_LIMIT, MINUTE_LIMIT, RateLimiter, SlidingWindow
+
+
+class FakeClock:
+    """Time that only moves forward when slept through."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def openaq_limiter(clock: FakeClock) -> RateLimiter:
+    return RateLimiter(
+        SlidingWindow(MINUTE_LIMIT, 60),
+        SlidingWindow(HOUR_LIMIT, 3600),
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+
+def max_in_window(times: list[float], period: float) -> int:
+    """Returns the most requests sent within any `period` seconds."""
+    times = sorted(times)
+    return max(
+        bisect_left(times, start + period) - first for first, start in enumerate(times)
+    )
+
+
+def test_limiter_never_exceeds_quotas():
+    clock = FakeClock()
+    limiter = openaq_limiter(clock)
+    sent = []
+
+    async def send():
+        await limiter.acquire()
+        sent.append(clock())
+
+    async def main():
+        await asyncio.gather(*(send() for _ in range(2 * HOUR_LIMIT + 100)))
+
+    asyncio.run(main())
+
+    assert max_in_window(sent, 60) == MINUTE_LIMIT
+    assert max_in_window(sent, 3600) == HOUR_LIMIT
+    # The hour quota is used up within the hour, not spread over two
+    assert sorted(sent)[HOUR_LIMIT - 1] < 3600
+
+
+def test_rate_limited_response_waits_without_retrying(monkeypatch):
+    clock = FakeClock()
+    limiter = openaq_limiter(clock)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "30"}),
+        httpx.Response(429),
+        httpx.Response(200, json={"results": []}),
+    ]
+    sent = []
+
+    async def arequest(endpoint, params=None):
+        sent.append(clock())
+        return responses.pop(0)
+
+    monkeypatch.setattr(session, "arequest", arequest)
+    monkeypatch.setattr(fetch.response_cache, "load", lambda *args: None)
+    monkeypatch.setattr(fetch.response_cache, "store", lambda *args: None)
+    retries = session.stats.retries
+
+    result = asyncio.run(fetch.api_call_async(limiter, "sensors/1/days/monthly"))
+
+    assert result == {"results": []}
+    assert sent == [0, 30, 30 + fetch.RATE_LIMITED_WAIT]
+    assert session.stats.retries == retries
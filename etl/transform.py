@@ -1,32 +1,99 @@
 """Handles data transformations and returns dataframes suited for db loading."""
 
-import time
+import asyncio
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from geopy.geocoders import Nominatim
-from extract import api_call
+import session
+from checkpoint import Checkpoint
+from fetch import fetch_sensor_measurements
+from geocode import OfflineGeocoder
+
+BATCH_SIZE = 100
+
+SUMMARY_COLUMNS = ["min", "q02", "q25", "median", "q75", "q98", "max", "avg", "sd"]
+
+MEASUREMENT_COLUMNS = [
+    "id",
+    "sensor_id",
+    "datetimeFrom",
+    "datetimeTo",
+    "value",
+    *SUMMARY_COLUMNS,
+]
+
+
+def transform_data(
+    extracted_data: dict,
+    watermarks: dict[int, pd.Timestamp] = None,
+    id_offset: int = 0,
+    checkpoint: Checkpoint = None,
+) -> dict[pd.DataFrame]:
+    """Transforms extracted data into one DataFrame per database table.
+
+    When `watermarks` is given the run is incremental: only sensors of active
+    locations, or sensors never loaded before, are fetched and only periods
+    from their watermark on are kept, the last loaded one included since it
+    may have been partial. New measurement IDs start at `id_offset`.
+
+    With a `checkpoint`, geocoded locations and fetched measurements are staged
+    on disk and reused from a previous interrupted attempt.
+    """
+    tables = transform_dimensions(extracted_data, checkpoint)
+    tables["measurements"] = transform_measurements(
+        select_sensors(tables, watermarks), watermarks, id_offset, checkpoint
+    )
+    return tables
 
-geolocator = Nominatim(user_agent="air-pollution")
 
+def transform_dimensions(
+    extracted_data: dict, checkpoint: Checkpoint = None
+) -> dict[pd.DataFrame]:
+    """Transforms the countries, pollutants, locations and sensors tables.
 
-def transform_data(extracted_data: dict) -> dict[pd.DataFrame]:
+    Geocoded locations are reused from `checkpoint` when it holds them.
+    """
     countries_df = transform_countries(extracted_data["countries"])
     pollutants_df = transform_pollutants(extracted_data["pollutants"])
-    locations_df = transform_locations(extracted_data["locations"])
-    locations_df = add_regional_information(locations_df)
+
+    locations_df = checkpoint.load_locations() if checkpoint else None
+    if locations_df is None:
+        locations_df = transform_locations(extracted_data["locations"])
+        locations_df = add_regional_information(locations_df)
+        if checkpoint:
+            checkpoint.save_locations(locations_df)
+
     sensors_df = transform_sensors(locations_df)
-    measurements_df = transform_measurements(sensors_df)
 
     return {
         "countries": countries_df,
         "pollutants": pollutants_df,
         "locations": locations_df,
         "sensors": sensors_df,
-        "measurements": measurements_df,
     }
 
 
+def select_sensors(
+    tables: dict[pd.DataFrame], watermarks: dict[int, pd.Timestamp] = None
+) -> pd.DataFrame:
+    """Returns the sensors whose measurements have to be fetched.
+
+    Every sensor is fetched on a full run. An incremental run skips sensors
+    of inactive locations that were already loaded.
+    """
+    sensors_df = tables["sensors"]
+    if watermarks is None:
+        return sensors_df
+
+    locations_df = tables["locations"]
+    active_location_ids = locations_df.loc[locations_df["active"], "id"]
+    to_refresh = sensors_df["location_id"].isin(active_location_ids) | ~sensors_df[
+        "id"
+    ].isin(watermarks.keys())
+    return sensors_df[to_refresh]
+
+
 def transform_countries(countries_json: dict) -> pd.DataFrame:
     return pd.DataFrame(countries_json)
 
@@ -105,122 +172,143 @@ def transform_sensors(locations_df: pd.DataFrame) -> pd.DataFrame:
     return sensors_df.reset_index(drop=True)
 
 
-def transform_measurements(sensors_df: pd.DataFrame) -> pd.DataFrame:
+def transform_measurements(
+    sensors_df: pd.DataFrame,
+    watermarks: dict[int, pd.Timestamp] = None,
+    id_offset: int = 0,
+    checkpoint: Checkpoint = None,
+) -> pd.DataFrame:
     """Transforms sensor measurement data from API responses.
 
+    Sensors are fetched concurrently within the API quota and their records
+    are normalized in columnar batches as they arrive. Sensors already staged
+    in `checkpoint` are not fetched again.
+
     Args:
         sensors_df (pd.DataFrame): DataFrame containing sensor IDs.
+        watermarks (dict[int, pd.Timestamp], optional): Start of the last
+            loaded period per sensor, only periods from it on are kept.
+        id_offset (int, optional): First measurement ID to assign.
+        checkpoint (Checkpoint, optional): Stage to resume from and save to.
 
     Returns:
         pd.DataFrame: Transformed measurement data.
     """
     measurements_list = []
-
-    minute_requests = 0
-    hour_requests = 0
-
-    for sensor_id in tqdm(sensors_df["id"], desc="Processing Sensors", unit="sensor"):
-        if hour_requests >= 1500:
-            print(
-                f"Hourly rate limit reached. Waiting 1hr starting {time.strftime("%H:%M:%S", time.localtime())}..."
-            )
-            time.sleep(3600)
-            hour_requests = 0
-
-        if minute_requests >= 50:
-            print(
-                f"Minute rate limit reached. Waiting 1min starting {time.strftime("%H:%M:%S", time.localtime())}..."
-            )
-            time.sleep(60)
-            minute_requests = 0
-
-        measurements_json = api_call(
-            f"sensors/{sensor_id}/days/monthly", {"limit": 1000}
-        )
-        measurements_df = pd.DataFrame(measurements_json.get("results", []))
-
-        if measurements_df.empty:
-            continue
-
-        measurements_df["sensor_id"] = sensor_id
-
-        measurements_df["datetimeFrom"] = pd.to_datetime(
-            measurements_df["period"].str["datetimeFrom"].str["utc"]
-        )
-        measurements_df["datetimeTo"] = pd.to_datetime(
-            measurements_df["period"].str["datetimeTo"].str["utc"]
-        )
-        summary_df = pd.json_normalize(measurements_df["summary"]).round(2)
-        measurements_df.drop(columns=["period", "summary"], inplace=True)
-
-        drop_cols = ["flagInfo", "parameter", "coordinates", "coverage"]
-        measurements_df.drop(columns=drop_cols, inplace=True)
-
-        measurements_list.append(pd.concat([measurements_df, summary_df], axis=1))
-
-        minute_requests += 1
-        hour_requests += 1
+    sensor_ids = sensors_df["id"].tolist()
+    if checkpoint:
+        measurements_list = checkpoint.load_measurements()
+        fetched_sensors = checkpoint.fetched_sensors
+        sensor_ids = [id_ for id_ in sensor_ids if id_ not in fetched_sensors]
+
+    measurements_list += asyncio.run(
+        collect_measurements(sensor_ids, watermarks or {}, checkpoint)
+    )
 
     measurements_df = (
         (
             pd.concat(measurements_list, ignore_index=True)
             if measurements_list
-            else pd.DataFrame()
+            else normalize_measurements([], [])
         )
         .reset_index(drop=False)
         .rename(columns={"index": "id"})
     )
+    measurements_df["id"] += id_offset
 
-    return measurements_df[
-        [
-            "id",
-            "sensor_id",
-            "datetimeFrom",
-            "datetimeTo",
-            "value",
-            "min",
-            "q02",
-            "q25",
-            "median",
-            "q75",
-            "q98",
-            "max",
-            "avg",
-            "sd",
-        ]
-    ]
+    return measurements_df[MEASUREMENT_COLUMNS]
 
-def get_city_and_region(latitude, longitude):
+
+async def collect_measurements(
+    sensor_ids: list[int],
+    watermarks: dict[int, pd.Timestamp],
+    checkpoint: Checkpoint = None,
+) -> list[pd.DataFrame]:
+    """Streams sensor responses into normalized batches of measurements.
+
+    Raw records are accumulated and normalized every BATCH_SIZE sensors, each
+    batch being staged in `checkpoint` when given.
     """
-    Retrieve the city, department, region, and postcode based on geographic coordinates.
+    measurements_list = []
+    batch_sensors, batch_sensor_ids, batch_records = [], [], []
 
-    Parameters:
-        latitude (float): Latitude coordinate of the location.
-        longitude (float): Longitude coordinate of the location.
+    def flush_batch():
+        measurements_df = normalize_measurements(
+            batch_sensor_ids, batch_records, watermarks
+        )
+        measurements_list.append(measurements_df)
+        if checkpoint:
+            checkpoint.add_measurements(batch_sensors, measurements_df)
+        batch_sensors.clear()
+        batch_sensor_ids.clear()
+        batch_records.clear()
 
-    Returns:
-        tuple: A tuple containing the city, department, region, and postcode.
+    try:
+        with tqdm(
+            total=len(sensor_ids), desc="Processing Sensors", unit="sensor"
+        ) as bar:
+            async for sensor_id, results in fetch_sensor_measurements(
+                sensor_ids, watermarks
+            ):
+                bar.update()
+                batch_sensors.append(sensor_id)
+                batch_sensor_ids += [sensor_id] * len(results)
+                batch_records += results
+                if len(batch_sensors) >= BATCH_SIZE:
+                    flush_batch()
+    finally:
+        if batch_sensors:
+            flush_batch()
+        await session.aclose()
+
+    return measurements_list
+
+
+def normalize_measurements(
+    sensor_ids: list[int],
+    records: list[dict],
+    watermarks: dict[int, pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """Normalizes raw monthly records into the measurements schema in one pass.
 
-    Exceptions:
-        If the geocoding request fails, None values are returned for all location attributes.
+    Args:
+        sensor_ids (list[int]): Sensor ID of each record.
+        records (list[dict]): Raw `sensors/{id}/days/monthly` results.
+        watermarks (dict[int, pd.Timestamp], optional): Start of the last
+            loaded period per sensor, earlier periods are dropped.
 
-    Example:
-        get_city_and_region(44.143, 4.139) -> ('Paris', 'Île-de-France', 'Île-de-France', '75000')
+    Returns:
+        pd.DataFrame: Measurements without IDs, with explicit dtypes.
     """
-    try:
-        location = geolocator.reverse((latitude, longitude))
-        if location:
-            address = location.raw.get("address", {})
-            town = address.get(
-                "municipality", address.get("city_district", "Not_found")
-            )
-            department = address.get("county", address.get("city", "Not_found"))
-            region = address.get("state", address.get("Île-de-france", "Not_found"))
-            postcode = address.get("postcode", "00000")
-            return town, department, region, postcode
-    except Exception as e:
-        print(f"Erreur lors du géocodage : {e}")
-    return None, None, None
+    periods = [record["period"] for record in records]
+    summaries = [record["summary"] for record in records]
+
+    measurements_df = pd.DataFrame(
+        {
+            "sensor_id": np.array(sensor_ids, dtype="int64"),
+            "datetimeFrom": pd.to_datetime(
+                [period["datetimeFrom"]["utc"] for period in periods], utc=True
+            ),
+            "datetimeTo": pd.to_datetime(
+                [period["datetimeTo"]["utc"] for period in periods], utc=True
+            ),
+            "value": np.array([record["value"] for record in records], dtype="float64"),
+            **{
+                stat: np.array(
+                    [summary.get(stat) for summary in summaries], dtype="float64"
+                ).round(2)
+                for stat in SUMMARY_COLUMNS
+            },
+        }
+    )
+
+    if watermarks:
+        watermark = measurements_df["sensor_id"].map(watermarks)
+        measurements_df = measurements_df[
+            watermark.isna() | (measurements_df["datetimeFrom"] >= watermark)
+        ]
+
+    return measurements_df
 
 
 def add_regional_information(locations_df: pd.DataFrame) -> pd.DataFrame:
@@ -233,26 +321,15 @@ def add_regional_information(locations_df: pd.DataFrame) -> pd.DataFrame:
 
     Returns:
         pd.DataFrame: The input DataFrame with additional columns for 'town', 'department', 'region', and 'postcode',
-                      populated with the corresponding location information retrieved via reverse geocoding.
+                      populated with the nearest commune of the offline communes reference.
     """
-    towns = []
-    departments = []
-    regions = []
-    postcodes = []
-
-    for index, row in locations_df.iterrows():
-        town, department, region, postcode = get_city_and_region(
-            row["latitude"], row["longitude"]
-        )
-        towns.append(town)
-        departments.append(department)
-        regions.append(region)
-        postcodes.append(postcode)
-        time.sleep(1)
-
-    locations_df.loc[:, "town"] = towns
-    locations_df.loc[:, "department"] = departments
-    locations_df.loc[:, "region"] = regions
-    locations_df.loc[:, "postcode"] = postcodes
+    regional_df = OfflineGeocoder().reverse(
+        locations_df["latitude"], locations_df["longitude"]
+    )
+
+    locations_df.loc[:, "town"] = regional_df["town"]
+    locations_df.loc[:, "department"] = regional_df["department"]
+    locations_df.loc[:, "region"] = regional_df["region"]
+    locations_df.loc[:, "postcode"] = regional_df["postcode"]
     locations_df["postcode"] = locations_df["postcode"].astype(int)
     return locations_df
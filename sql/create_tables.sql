@@ -23,7 +23,7 @@ locality VARCHAR(150) NOT NULL,
     town VARCHAR(150) NOT NULL,
     department VARCHAR(150) NOT NULL,
     region VARCHAR(150) NOT NULL,
-    postcode BIGINT NOT NULL,
+    postcode BIGINT NOT NULL
 );
 
 CREATE TABLE sensors (
@@ -32,8 +32,10 @@ location_id BIGINT REFERENCES locations(id),
 pollutant_id BIGINT REFERENCES pollutants(id)
 ) ;
 
+-- Partitioned by month of datetimeFrom so date range scans only read the
+-- matching partitions. Keys have to include the partition column.
 CREATE TABLE measurements (
-id BIGSERIAL NOT NULL PRIMARY KEY,
+id BIGSERIAL NOT NULL,
 sensor_id BIGINT REFERENCES sensors(id),
 datetimeFrom TIMESTAMP NOT NULL,
 datetimeTo TIMESTAMP NOT NULL,
@@ -46,5 +48,170 @@ q75 REAL NOT NULL,
 q98 REAL NOT NULL,
 max REAL NOT NULL,
 avg REAL NOT NULL,
-sd REAL NOT NULL
+sd REAL NOT NULL,
+PRIMARY KEY (id, datetimeFrom),
+UNIQUE (sensor_id, datetimeFrom)
+) PARTITION BY RANGE (datetimeFrom);
+
+-- Catches rows outside the monthly partitions created by the loader
+CREATE TABLE measurements_default PARTITION OF measurements DEFAULT;
+
+-- heatmap_data and get_seasons filter on datetimeTo and aggregate value per
+-- sensor, which this index covers without reading the partitions themselves
+CREATE INDEX measurements_datetimeto_idx ON measurements (datetimeTo)
+INCLUDE (sensor_id, datetimeFrom, value);
+
+CREATE INDEX sensors_location_id_idx ON sensors (location_id);
+CREATE INDEX sensors_pollutant_id_idx ON sensors (pollutant_id);
+
+-- Creates the missing monthly partitions of measurements between two dates
+CREATE OR REPLACE FUNCTION create_measurement_partitions(
+    start_date TIMESTAMP,
+    end_date TIMESTAMP
+) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', start_date);
+    partition_name TEXT;
+BEGIN
+    WHILE month_start <= end_date LOOP
+        partition_name := format('measurements_%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF measurements FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                month_start,
+                month_start + INTERVAL '1 month'
+            );
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+END;
+$$;
+
+-- Monthly summaries of measurements per town, department and region, so
+-- dashboard queries read a few thousand rows instead of every measurement.
+-- A measurement counts towards the month of its period midpoint. department
+-- and region locate each row, department is empty on region rows.
+CREATE TABLE measurement_rollups (
+    location_level VARCHAR(10) NOT NULL,
+    location VARCHAR(150) NOT NULL,
+    department VARCHAR(150) NOT NULL,
+    region VARCHAR(150) NOT NULL,
+    pollutant_id BIGINT NOT NULL REFERENCES pollutants(id),
+    month DATE NOT NULL,
+    count BIGINT NOT NULL,
+    sum DOUBLE PRECISION NOT NULL,
+    mean DOUBLE PRECISION NOT NULL,
+    min REAL NOT NULL,
+    q25 DOUBLE PRECISION NOT NULL,
+    median DOUBLE PRECISION NOT NULL,
+    q75 DOUBLE PRECISION NOT NULL,
+    max REAL NOT NULL,
+    sensors BIGINT NOT NULL,
+    datetime_from TIMESTAMP NOT NULL,
+    datetime_to TIMESTAMP NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (location_level, location, department, region, pollutant_id, month)
+);
+
+CREATE INDEX measurement_rollups_pollutant_idx
+ON measurement_rollups (location_level, pollutant_id, datetime_to);
+
+-- Recomputes the rollups of every month from `since` on, all of them when NULL
+CREATE OR REPLACE FUNCTION refresh_measurement_rollups(
+    since TIMESTAMP DEFAULT NULL
+) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    start_month TIMESTAMP := date_trunc('month', COALESCE(since, '-infinity'));
+BEGIN
+    DELETE FROM measurement_rollups WHERE month >= start_month;
+
+    INSERT INTO measurement_rollups
+    SELECT
+        lv.location_level,
+        lv.location,
+        lv.department,
+        l.region,
+        s.pollutant_id,
+        r.month,
+        COUNT(*),
+        SUM(m.value),
+        AVG(m.value),
+        MIN(m.value),
+        percentile_cont(0.25) WITHIN GROUP (ORDER BY m.value),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY m.value),
+        percentile_cont(0.75) WITHIN GROUP (ORDER BY m.value),
+        MAX(m.value),
+        COUNT(DISTINCT m.sensor_id),
+        MIN(m.datetimeFrom),
+        MAX(m.datetimeTo),
+        AVG(l.latitude),
+        AVG(l.longitude)
+    FROM measurements AS m
+    JOIN sensors AS s ON s.id = m.sensor_id
+    JOIN locations AS l ON l.id = s.location_id
+    CROSS JOIN LATERAL (
+        VALUES
+            ('town', l.town, l.department),
+            ('department', l.department, l.department),
+            ('region', l.region, '')
+    ) AS lv(location_level, location, department)
+    CROSS JOIN LATERAL (
+        SELECT date_trunc(
+            'month', m.datetimeFrom + (m.datetimeTo - m.datetimeFrom) / 2
+        )::date AS month
+    ) AS r
+    WHERE m.datetimeFrom >= start_month - INTERVAL '1 month'
+      AND r.month >= start_month
+    GROUP BY
+        lv.location_level, lv.location, lv.department, l.region, s.pollutant_id, r.month;
+END;
+$$;
+
+-- Measurements joined with their location and pollutant, read by
+-- get_filter_data and get_measurements_by_date_range instead of repeating
+-- the join. The unique index lets it be refreshed concurrently.
+CREATE MATERIALIZED VIEW measurement_details AS
+SELECT
+    m.id,
+    m.sensor_id,
+    l.town,
+    l.department,
+    l.region,
+    p.name AS pollutant,
+    p.units,
+    m.value,
+    m.datetimeFrom,
+    m.datetimeTo
+FROM measurements AS m
+JOIN sensors AS s ON s.id = m.sensor_id
+JOIN locations AS l ON l.id = s.location_id
+JOIN pollutants AS p ON p.id = s.pollutant_id;
+
+CREATE UNIQUE INDEX measurement_details_key
+ON measurement_details (sensor_id, datetimeFrom);
+
+-- Keyset pagination walks (datetimeFrom, id) in order
+CREATE INDEX measurement_details_keyset_idx
+ON measurement_details (datetimeFrom, id);
+
+CREATE INDEX measurement_details_pollutant_idx
+ON measurement_details (pollutant, datetimeFrom, id);
+
+-- Refreshes the dashboard views, readers keep the previous rows meanwhile
+CREATE OR REPLACE FUNCTION refresh_dashboard_views() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY measurement_details;
+END;
+$$;
+
+-- One row per completed ETL run. The dashboard keys its cached results on
+-- the latest id, so each load invalidates them.
+CREATE TABLE etl_runs (
+    id BIGSERIAL NOT NULL PRIMARY KEY,
+    finished_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    incremental BOOLEAN NOT NULL,
+    measurements BIGINT NOT NULL
 );
@@ -0,0 +1,29 @@
+-- Adds the natural key (sensor_id, datetimeFrom) that upsert loads merge on
+-- to the flat measurements table of an existing database. Runs before
+-- 001_partition_measurements.sql.
+-- Reruns loaded some periods more than once, only the last loaded row of
+-- each period, the one with the highest id, is kept.
+
+BEGIN;
+
+DELETE FROM measurements
+WHERE id IN (
+    SELECT id
+    FROM (
+        SELECT
+            id,
+            ROW_NUMBER() OVER (
+                PARTITION BY sensor_id, datetimeFrom ORDER BY id DESC
+            ) AS rank
+        FROM measurements
+    ) AS ranked
+    WHERE rank > 1
+);
+
+ALTER TABLE measurements
+    ADD CONSTRAINT measurements_sensor_id_datetimefrom_key
+    UNIQUE (sensor_id, datetimeFrom);
+
+COMMIT;
+
+ANALYZE measurements;
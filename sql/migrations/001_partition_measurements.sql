@@ -0,0 +1,78 @@
+-- Migrates the flat measurements table to monthly partitions on datetimeFrom.
+-- Rows and IDs are kept, the id sequence is handed over to the new table.
+-- Periods loaded more than once keep their last loaded row, as in
+-- 000_measurements_natural_key.sql.
+-- Runs in one transaction: readers keep seeing the flat table until COMMIT.
+
+BEGIN;
+
+ALTER TABLE measurements RENAME TO measurements_flat;
+ALTER TABLE measurements_flat RENAME CONSTRAINT measurements_pkey TO measurements_flat_pkey;
+-- Only there once 000 was applied, its name is taken by the new table
+ALTER TABLE measurements_flat
+    DROP CONSTRAINT IF EXISTS measurements_sensor_id_datetimefrom_key;
+
+CREATE TABLE measurements (
+id BIGINT NOT NULL DEFAULT nextval('measurements_id_seq'),
+sensor_id BIGINT REFERENCES sensors(id),
+datetimeFrom TIMESTAMP NOT NULL,
+datetimeTo TIMESTAMP NOT NULL,
+value REAL NOT NULL,
+min REAL NOT NULL,
+q02 REAL NOT NULL,
+q25 REAL NOT NULL,
+median REAL NOT NULL,
+q75 REAL NOT NULL,
+q98 REAL NOT NULL,
+max REAL NOT NULL,
+avg REAL NOT NULL,
+sd REAL NOT NULL,
+PRIMARY KEY (id, datetimeFrom),
+UNIQUE (sensor_id, datetimeFrom)
+) PARTITION BY RANGE (datetimeFrom);
+
+CREATE TABLE measurements_default PARTITION OF measurements DEFAULT;
+
+CREATE INDEX measurements_datetimeto_idx ON measurements (datetimeTo)
+INCLUDE (sensor_id, datetimeFrom, value);
+
+CREATE INDEX IF NOT EXISTS sensors_location_id_idx ON sensors (location_id);
+CREATE INDEX IF NOT EXISTS sensors_pollutant_id_idx ON sensors (pollutant_id);
+
+CREATE OR REPLACE FUNCTION create_measurement_partitions(
+    start_date TIMESTAMP,
+    end_date TIMESTAMP
+) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', start_date);
+    partition_name TEXT;
+BEGIN
+    WHILE month_start <= end_date LOOP
+        partition_name := format('measurements_%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF measurements FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                month_start,
+                month_start + INTERVAL '1 month'
+            );
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+END;
+$$;
+
+SELECT create_measurement_partitions(MIN(datetimeFrom), MAX(datetimeFrom))
+FROM measurements_flat;
+
+INSERT INTO measurements
+SELECT DISTINCT ON (sensor_id, datetimeFrom) *
+FROM measurements_flat
+ORDER BY sensor_id, datetimeFrom, id DESC;
+
+ALTER SEQUENCE measurements_id_seq OWNED BY measurements.id;
+DROP TABLE measurements_flat;
+
+COMMIT;
+
+ANALYZE measurements;
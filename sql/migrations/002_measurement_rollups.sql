@@ -0,0 +1,88 @@
+-- Adds the monthly measurement rollups to an existing database and fills them.
+
+BEGIN;
+
+-- Monthly summaries of measurements per town, department and region, so
+-- dashboard queries read a few thousand rows instead of every measurement.
+-- A measurement counts towards the month of its period midpoint. department
+-- and region locate each row, department is empty on region rows.
+CREATE TABLE measurement_rollups (
+    location_level VARCHAR(10) NOT NULL,
+    location VARCHAR(150) NOT NULL,
+    department VARCHAR(150) NOT NULL,
+    region VARCHAR(150) NOT NULL,
+    pollutant_id BIGINT NOT NULL REFERENCES pollutants(id),
+    month DATE NOT NULL,
+    count BIGINT NOT NULL,
+    sum DOUBLE PRECISION NOT NULL,
+    mean DOUBLE PRECISION NOT NULL,
+    min REAL NOT NULL,
+    q25 DOUBLE PRECISION NOT NULL,
+    median DOUBLE PRECISION NOT NULL,
+    q75 DOUBLE PRECISION NOT NULL,
+    max REAL NOT NULL,
+    sensors BIGINT NOT NULL,
+    datetime_from TIMESTAMP NOT NULL,
+    datetime_to TIMESTAMP NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (location_level, location, department, region, pollutant_id, month)
+);
+
+CREATE INDEX measurement_rollups_pollutant_idx
+ON measurement_rollups (location_level, pollutant_id, datetime_to);
+
+-- Recomputes the rollups of every month from `since` on, all of them when NULL
+CREATE OR REPLACE FUNCTION refresh_measurement_rollups(
+    since TIMESTAMP DEFAULT NULL
+) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    start_month TIMESTAMP := date_trunc('month', COALESCE(since, '-infinity'));
+BEGIN
+    DELETE FROM measurement_rollups WHERE month >= start_month;
+
+    INSERT INTO measurement_rollups
+    SELECT
+        lv.location_level,
+        lv.location,
+        lv.department,
+        l.region,
+        s.pollutant_id,
+        r.month,
+        COUNT(*),
+        SUM(m.value),
+        AVG(m.value),
+        MIN(m.value),
+        percentile_cont(0.25) WITHIN GROUP (ORDER BY m.value),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY m.value),
+        percentile_cont(0.75) WITHIN GROUP (ORDER BY m.value),
+        MAX(m.value),
+        COUNT(DISTINCT m.sensor_id),
+        MIN(m.datetimeFrom),
+        MAX(m.datetimeTo),
+        AVG(l.latitude),
+        AVG(l.longitude)
+    FROM measurements AS m
+    JOIN sensors AS s ON s.id = m.sensor_id
+    JOIN locations AS l ON l.id = s.location_id
+    CROSS JOIN LATERAL (
+        VALUES
+            ('town', l.town, l.department),
+            ('department', l.department, l.department),
+            ('region', l.region, '')
+    ) AS lv(location_level, location, department)
+    CROSS JOIN LATERAL (
+        SELECT date_trunc(
+            'month', m.datetimeFrom + (m.datetimeTo - m.datetimeFrom) / 2
+        )::date AS month
+    ) AS r
+    WHERE m.datetimeFrom >= start_month - INTERVAL '1 month'
+      AND r.month >= start_month
+    GROUP BY
+        lv.location_level, lv.location, lv.department, l.region, s.pollutant_id, r.month;
+END;
+$$;
+
+SELECT refresh_measurement_rollups();
+
+COMMIT;
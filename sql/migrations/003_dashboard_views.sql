@@ -0,0 +1,38 @@
+-- Adds the materialized dashboard views to an existing database.
+
+BEGIN;
+
+-- Measurements joined with their location and pollutant, read by
+-- get_filter_data and get_measurements_by_date_range instead of repeating
+-- the join. The unique index lets it be refreshed concurrently.
+CREATE MATERIALIZED VIEW measurement_details AS
+SELECT
+    m.sensor_id,
+    l.town,
+    l.department,
+    l.region,
+    p.name AS pollutant,
+    p.units,
+    m.value,
+    m.datetimeFrom,
+    m.datetimeTo
+FROM measurements AS m
+JOIN sensors AS s ON s.id = m.sensor_id
+JOIN locations AS l ON l.id = s.location_id
+JOIN pollutants AS p ON p.id = s.pollutant_id;
+
+CREATE UNIQUE INDEX measurement_details_key
+ON measurement_details (sensor_id, datetimeFrom);
+
+CREATE INDEX measurement_details_datetimefrom_idx
+ON measurement_details (datetimeFrom);
+
+-- Refreshes the dashboard views, readers keep the previous rows meanwhile
+CREATE OR REPLACE FUNCTION refresh_dashboard_views() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY measurement_details;
+END;
+$$;
+
+COMMIT;
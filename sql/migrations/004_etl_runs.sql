@@ -0,0 +1,10 @@
+-- Adds the ETL run log read by the dashboard cache to an existing database.
+
+-- One row per completed ETL run. The dashboard keys its cached results on
+-- the latest id, so each load invalidates them.
+CREATE TABLE etl_runs (
+    id BIGSERIAL NOT NULL PRIMARY KEY,
+    finished_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    incremental BOOLEAN NOT NULL,
+    measurements BIGINT NOT NULL
+);
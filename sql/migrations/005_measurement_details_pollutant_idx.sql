@@ -0,0 +1,3 @@
+-- Serves the pollutant filter of get_measurements_by_date_range.
+CREATE INDEX IF NOT EXISTS measurement_details_pollutant_idx
+ON measurement_details (pollutant, datetimeFrom);
@@ -0,0 +1,38 @@
+-- Rebuilds measurement_details with the measurement id, so large results can
+-- be paged by keyset on (datetimeFrom, id).
+
+BEGIN;
+
+DROP MATERIALIZED VIEW measurement_details;
+
+-- Measurements joined with their location and pollutant, read by
+-- get_filter_data and get_measurements_by_date_range instead of repeating
+-- the join. The unique index lets it be refreshed concurrently.
+CREATE MATERIALIZED VIEW measurement_details AS
+SELECT
+    m.id,
+    m.sensor_id,
+    l.town,
+    l.department,
+    l.region,
+    p.name AS pollutant,
+    p.units,
+    m.value,
+    m.datetimeFrom,
+    m.datetimeTo
+FROM measurements AS m
+JOIN sensors AS s ON s.id = m.sensor_id
+JOIN locations AS l ON l.id = s.location_id
+JOIN pollutants AS p ON p.id = s.pollutant_id;
+
+CREATE UNIQUE INDEX measurement_details_key
+ON measurement_details (sensor_id, datetimeFrom);
+
+-- Keyset pagination walks (datetimeFrom, id) in order
+CREATE INDEX measurement_details_keyset_idx
+ON measurement_details (datetimeFrom, id);
+
+CREATE INDEX measurement_details_pollutant_idx
+ON measurement_details (pollutant, datetimeFrom, id);
+
+COMMIT;